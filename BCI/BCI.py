@@ -1,23 +1,26 @@
 import argparse
 import glob
-import joblib
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import pandas as pd
 import random
 import shutil
 import subprocess
+import warnings
 from collections import Counter
 from itertools import combinations
-from matplotlib import cm
-from scipy.stats import entropy
+
+# Heavy dependencies (joblib, pandas, scipy, matplotlib) are imported inside
+# the functions that need them so `import BCI` stays cheap for short-lived
+# worker processes. Plotting lives in the lazily loaded BCI.plotting module.
 
 
 class BCI:
     def __init__(self,
                  data,
                  project_dir=".",
+                 dereplicate=False,
+                 approximate=False,
+                 pi_estimator="alignment",
                  verbose=False):
         # Path to the input data file which may be manipulated
         # by the .transform() function
@@ -27,10 +30,28 @@ class BCI:
 
         # Retain a reference to the untransformed data
         self._data = data
+        # The file that is actually clustered. This is self.data, or a
+        # dereplicated copy of it if dereplication is enabled.
+        self._clust_data = data
+        # Collapse identical sequences before clustering. Maps unique
+        # sequence IDs to the number of copies in self.data, or None.
+        # Only fasta input is dereplicated, it's ignored for fastq.
+        self._dereplicate = dereplicate
+        self._abundances = None
+        # Estimate cluster counts from MinHash sketches instead of running
+        # vsearch at every threshold (see BCI.sketch)
+        self._approximate = approximate
+        # How to calculate per OTU pi: 'alignment' aligns the members of each
+        # OTU, 'identity' estimates pi from the vsearch hit identities
+        if pi_estimator not in ["alignment", "identity"]:
+            raise ValueError("pi_estimator must be one of: alignment, identity.")
+        self._pi_estimator = pi_estimator
         # Get the name of this sample. Allow sample names to include '.'
         self.samp = data.split("/")[-1].rsplit(".", 1)[0]
         # Is the input fastq or fasta?
         self._ftype = data.split(".")[-1]
+        if self._dereplicate and 'q' in self._ftype:
+            print(f"  warning: dereplicate is only supported for fasta input, ignoring it for {self.data}")
 
         self.tmpdir = f"{project_dir}/.tmpdir-{self.samp}"
         if not os.path.exists(self.tmpdir):
@@ -50,6 +71,13 @@ class BCI:
         self._OTU_threshold = 0.97
         self._pseudo_variable_sites = 0
         self.cores = 20
+        self._sketch_k = 8
+        self._sketch_size = 256
+        self._sketch_batch_size = 4096
+        # Number of OTUs to align to validate identity based pi, and the
+        # tolerated relative difference from the alignment based pi
+        self._pi_validate_otus = 10
+        self._pi_validate_tolerance = 0.25
 
 
     # FIXME: Is swarm better here? It works quite differently, and wouldn't work
@@ -61,7 +89,7 @@ class BCI:
         for tol in self.tols:
             outfile = f"{self.tmpdir}/{self.samp}-{tol:.3f}"
             cmd = ["vsearch",
-                   "-cluster_smallmem", f"{self.data}",
+                   "-cluster_smallmem", f"{self._clust_data}",
                    "-strand", "plus",
                    "-id", f"{tol}",
                    "-userout", f"{outfile}.utmp",
@@ -79,7 +107,30 @@ class BCI:
 
     ## FIXME: Add a check that vsearch is installed
     ## FIXME: Make n_jobs dynamic
-    def run(self, simulated=False, verbose=False):
+    def run(self, simulated=False, approximate=None, verbose=False):
+        """
+        Cluster the data at each identity threshold and calculate the BCI and
+        nucleotide diversity.
+
+        approximate - Estimate cluster counts from MinHash sketches rather than
+                      clustering with vsearch (see BCI.sketch for the error
+                      bound). Much faster for very large datasets, but nucleotide
+                      diversity is not calculated. If None use the value passed
+                      to the constructor.
+        """
+        if approximate is None: approximate = self._approximate
+        if approximate:
+            return self._run_sketch(verbose=verbose)
+
+        import joblib
+        import pandas as pd
+
+        # Collapse identical sequences into unique records with counts
+        if self._dereplicate and not 'q' in self._ftype:
+            self._clust_data, self._abundances = self._dereplicate_data(simulated=simulated)
+        else:
+            self._clust_data, self._abundances = self.data, None
+
         # Build the list of vsearch commands
         self._build_cmds()
         # Run all vsearch commands in parallel
@@ -105,50 +156,85 @@ class BCI:
             raise
 
 
+    def _run_sketch(self, verbose=False):
+        from . import sketch
+
+        self.tols = np.arange(100, self._min_clust_threshold, -1)/100
+        unbounded = [x for x in self.tols if sketch.error_bound(x) is None]
+        if unbounded:
+            # A warning rather than a print, so a Project with thousands of
+            # samples and sites only shows it once
+            warnings.warn(f"Approximate cluster counts have no error bound at thresholds"
+                            + f" {max(unbounded):.2f} to {min(unbounded):.2f}, use exact mode"
+                            + " for these (see BCI.sketch).", stacklevel=2)
+        # Stream the sequences, they are sketched and clustered in batches
+        seqs = sketch.read_sequences(self.data, fastq='q' in self._ftype)
+        self.bci = sorted(sketch.cluster_counts(seqs,
+                                                self.tols,
+                                                k=self._sketch_k,
+                                                sketch_size=self._sketch_size,
+                                                batch_size=self._sketch_batch_size,
+                                                verbose=self._verbose or verbose).tolist(),
+                            reverse=True)
+        if self._verbose or verbose: print(self.bci)
+        # Store the results
+        self._results.setdefault(self._label, [])
+        self._results[self._label].append(self.bci)
+
+
+    def _dereplicate_data(self, simulated=False):
+        """
+        Collapse identical sequences in self.data into one record per unique
+        sequence, named by the ID of its first occurrence. Records are written
+        in order of first occurrence. With -usersort a duplicate is never a new
+        seed (its first copy is a seed or matched one already), so the seeds
+        and the BCI are the same as for the full data. OTU membership, and so
+        the OTU pis, can differ slightly: with -maxaccepts 1 vsearch accepts the
+        first matching seed in order of shared k-mers, which is not always the
+        seed the first copy was assigned to.
+
+        simulated - Sequence names are `<species>_<n>`, and identical sequences
+                    are only collapsed within a species, so the simulated
+                    species pis are the same as for the full data.
+
+        Returns the path to the dereplicated fasta and a dictionary mapping
+        unique sequence IDs to the number of copies.
+        """
+        with open(self.data) as infile:
+            dat = infile.read().split()
+
+        seen = {}
+        abundances = {}
+        for name, seq in zip(dat[::2], dat[1::2]):
+            key = (name[1:].rsplit("_", 1)[0], seq) if simulated else seq
+            if key in seen:
+                abundances[seen[key]] += 1
+            else:
+                seen[key] = name[1:]
+                abundances[name[1:]] = 1
+
+        derep = os.path.join(self.tmpdir, f"{self._label}-derep.{self._ftype}")
+        with open(derep, 'w') as outfile:
+            for key, name in seen.items():
+                seq = key[1] if simulated else key
+                outfile.write(f">{name}\n{seq}\n")
+        if self._verbose:
+            print(f"  Dereplicated {len(dat)//2} sequences to {len(seen)} unique: {derep}")
+        return derep, abundances
+
+
     def clean(self):
         shutil.rmtree(self.tmpdir)
 
 
     def plot(self, ax=None, log=True, normalize=False, plot_pis=False, **kwargs):
-        if not ax:
-            fig, ax = plt.subplots(figsize=(8, 8))
-        fig = ax.get_figure()
-
-        if plot_pis:
-            try:
-                dat = np.array(sorted(self.pis.values(), reverse=True))
-            except:
-                print("  BCI does not have pi data, giving up the plot.")
-                return None, None
-        else:
-            # log transform (pis have 0 values so don't like log'ing
-            dat = np.log(self.bci) if log else np.array(self.bci)
-
-        # normalize
-        norm = dat.sum() if normalize else 1
-        ax.plot(np.array(dat)/norm, label=self._label, **kwargs)
-        ax.legend(loc='upper right', bbox_to_anchor=(0.97, 0.97))
-        return fig, ax
+        from .plotting import plot_bci
+        return plot_bci(self, ax=ax, log=log, normalize=normalize, plot_pis=plot_pis, **kwargs)
 
 
     def plot_all(self, ax=None, log=True, normalize=False, cmap="Spectral", **kwargs):
-        if not ax:
-            fig, ax = plt.subplots(figsize=(8, 8))
-        fig = ax.get_figure()
-
-        cmap = cm.get_cmap(cmap)
-        # Get a dictionary mapping labels to evenly spaced color values in the cmap
-        cdict = {k:cmap(i/len(self._results)) for i, k in enumerate(self._results.keys())}
-
-        for label, bcis in self._results.items():
-            for bci in bcis:
-                # log transform
-                dat = np.log(bci) if log else bci
-                # normalize
-                norm = dat.sum() if normalize else 1
-                ax.plot(np.array(dat)/norm, label=label, color=cdict[label], **kwargs)
-        ax.legend(loc='upper right', bbox_to_anchor=(0.97, 0.97))
-        return fig, ax
+        from .plotting import plot_results
+        return plot_results(self, ax=ax, log=log, normalize=normalize, cmap=cmap, **kwargs)
 
 
     def transform(self, transformation=None, fraction=0.5, count=None):
@@ -227,55 +313,170 @@ class BCI:
                     simulated then the sequences are organized into known species
                     and we can calculate pi for both the known simulated species
                     identies and also the 97% OTUs (for comparison).
+
+        If the data were dereplicated then each unique sequence is weighted by
+        its number of copies, which gives the same species pis as the full data.
+        OTU pis can differ slightly (see _dereplicate_data).
+
+        With pi_estimator='identity' the OTU pis are estimated from the
+        clustering identities (see _identity_pis) rather than from alignments,
+        and a random subset of OTUs is aligned to check the estimate.
         """
-        def pi_from_fasta(data):
+        import pandas as pd
+
+        def pi_from_fasta(data, abundances=None):
             """
             An inner function for calculating pi from an input fasta file.
             The nested function is so we can call it multiple times for simulated
             data on both the raw file and clustered OTU file.
+
+            abundances - Optional dictionary mapping sequence IDs to the number
+                         of copies of each sequence. Sequences not in the
+                         dictionary are counted once.
             """
             with open(data) as infile:
                 #Drop the trailing newline
                 dat = infile.read().strip().split()
             # Simulated data species ids are of the form >r0_x
-            self.pis = {x:0 for x in set([x.rsplit("_", 1)[0][1:] for x in dat[::2]])}
+            pis = {x:0 for x in set([x.rsplit("_", 1)[0][1:] for x in dat[::2]])}
             # Set the index to the species id
             # Creates a df of the form:
             #   species_ID_1    ACGTC...
             #   species_ID_1    ACGGC...
             #   species_ID_2    CCGGC
             seq_df = pd.DataFrame(dat[1::2], index=[x.rsplit("_", 1)[0][1:] for x in dat[::2]], columns=["seqs"])
-            for spid in self.pis.keys():
+            if abundances:
+                seq_df["counts"] = [abundances.get(x[1:], 1) for x in dat[::2]]
+            for spid in pis.keys():
                 # handle the case where there is only one seq in the seq_df, in which case
                 # it returns a raw string rather than an array
                 seqs = seq_df.loc[spid]["seqs"]
                 if isinstance(seqs, str):
                     seqs = pd.Series(seqs)
-                pi = self._nucleotide_diversity(seqs)
+                counts = np.atleast_1d(seq_df.loc[spid]["counts"]) if abundances else None
+                pi = self._nucleotide_diversity(seqs, counts=counts)
                 # Add a very small value to all pis
                 if self._pseudo_variable_sites: pi += 0.0001
-                self.pis[spid] = pi
+                pis[spid] = pi
+            return pis
 
         if simulated:
             ## Only want to do this for simulated data because empirical data doesn't have
             ## known species membership
-            pi_from_fasta(self.data)
+            self.pis = pi_from_fasta(self._clust_data, abundances=self._abundances)
             self.sim_pis = self.pis.copy()
 
-        aligned = self._align_OTUs(OTU_threshold=OTU_threshold,
-                                    pseudo_variable_sites=pseudo_variable_sites,
-                                    verbose=verbose)
-        pi_from_fasta(aligned)
+        if self._pi_estimator == "identity":
+            self.pis = self._identity_pis(OTU_threshold=OTU_threshold)
+            # Align a few OTUs with more than one member and check the estimate
+            otus = [x for x, n in self._otu_sizes.items() if n > 1]
+            nvalidate = min(len(otus), self._pi_validate_otus)
+            if nvalidate:
+                otus = list(np.random.choice(otus, nvalidate, replace=False))
+                aligned, abundances = self._align_OTUs(OTU_threshold=OTU_threshold,
+                                            pseudo_variable_sites=pseudo_variable_sites,
+                                            otus=otus,
+                                            verbose=verbose)
+                self._validate_pis(pi_from_fasta(aligned, abundances=abundances), otus=otus)
+        else:
+            aligned, abundances = self._align_OTUs(OTU_threshold=OTU_threshold,
+                                        pseudo_variable_sites=pseudo_variable_sites,
+                                        verbose=verbose)
+            self.pis = pi_from_fasta(aligned, abundances=abundances)
         self.hill_numbers = [self._generalized_hill_number(list(self.pis.values()), order=x) for x in range(4)]
 
 
-    def _align_OTUs(self, OTU_threshold=0.97, pseudo_variable_sites=0, verbose=False):
-        # Read the utmp file to get hits matching to seeds
-        # Retain only columns 0 (hits) and 1 (seeds). Set the index to the seed names
-        utmp = glob.glob(self.tmpdir+f"/*{OTU_threshold}*.utmp")[0]
+    def _identity_pis(self, OTU_threshold=0.97):
+        """
+        Estimate pi per OTU without aligning, from the identity of each hit to
+        its seed in the vsearch userout at `OTU_threshold`. Assuming the
+        differences of each hit from the seed are independent (a star
+        genealogy), the distance between hits i and j is d_i + d_j, where
+        d = 1 - identity. Averaging over all pairs of (copies of) sequences in
+        the OTU, with w_i copies of hit i and n copies in total:
+
+            pi = sum_i w_i * d_i * (n - w_i) / (n * (n - 1) / 2)
+
+        This overestimates pi when hits share differences from the seed, so
+        nucleotide_diversity() checks it against alignments of a few OTUs.
+        Singletons get pi 0, as with the alignment based estimate.
+        """
+        import pandas as pd
+
+        # Columns 0 (hits), 1 (seeds) and 2 (percent identity)
+        hits = pd.read_csv(self._utmp_file(OTU_threshold), sep="\t", header=None,
+                            usecols=[0,1,2], dtype={0:str, 1:str, 2:float})
+        abunds = self._abundances or {}
+
+        # Every sequence starts as its own OTU (seed or singleton) at distance 0
+        dists = {zid:[] for zid in self._fasta_to_df().index}
+        for hit, seed, ident in hits.itertuples(index=False):
+            dists.pop(hit, None)
+            dists.setdefault(seed, []).append((abunds.get(hit, 1), 1 - ident/100))
+
+        pis = {}
+        self._otu_sizes = {}
+        for otu, members in dists.items():
+            w = np.array([abunds.get(otu, 1)] + [x[0] for x in members], dtype=float)
+            d = np.array([0] + [x[1] for x in members], dtype=float)
+            n = w.sum()
+            pi = np.sum(w*d*(n - w))/(n*(n - 1)/2) if n > 1 else 0
+            # Add a very small value to all pis
+            if self._pseudo_variable_sites: pi += 0.0001
+            pis[otu] = pi
+            self._otu_sizes[otu] = len(w)
+        return pis
+
+
+    def _validate_pis(self, exact_pis, otus=None):
+        """
+        Compare identity based pis to alignment based pis for a subset of OTUs.
+        Results are stored in self.pi_validation and OTUs that differ by more
+        than self._pi_validate_tolerance (relative) are flagged.
+
+        otus - The OTUs that were aligned for validation. Any of these missing
+               from `exact_pis` (e.g. because muscle failed) are reported.
+        """
+        import pandas as pd
+
+        missing = [x for x in otus or [] if x not in exact_pis]
+        if missing:
+            print(f"  warning: no alignment based pi for {len(missing)} of {len(otus)}"
+                  f" OTUs chosen to validate identity based pi in {self._label},"
+                  f" validated {len(otus) - len(missing)}. Is muscle installed?")
+
+        otus = list(exact_pis.keys())
+        val = pd.DataFrame({"identity":[self.pis[x] for x in otus],
+                            "alignment":[exact_pis[x] for x in otus]}, index=otus)
+        val["rel_diff"] = (val["identity"] - val["alignment"]).abs()/val["alignment"].where(val["alignment"] > 0)
+        # Zero alignment pi only agrees with a zero estimate
+        val.loc[val["alignment"] == 0, "rel_diff"] = np.where(val.loc[val["alignment"] == 0, "identity"] > 0, np.inf, 0)
+        val["flagged"] = val["rel_diff"] > self._pi_validate_tolerance
+        self.pi_validation = val
+        if val["flagged"].any():
+            print(f"  warning: identity based pi differs from alignment based pi by more than"
+                  f" {self._pi_validate_tolerance:.0%} for {val['flagged'].sum()} of {len(val)}"
+                  f" validated OTUs in {self._label}. See `pi_validation`.")
+
+
+    def _utmp_file(self, OTU_threshold=0.97):
+        utmp = glob.glob(self.tmpdir+f"/*{OTU_threshold}*.utmp")
         if not utmp:
             # Something happened, no utmp file
-            raise Exception("No utmp file found with OTU_threshold: {OTU_threshold}")
+            raise Exception(f"No utmp file found with OTU_threshold: {OTU_threshold}")
+        return utmp[0]
+
+
+    def _align_OTUs(self, OTU_threshold=0.97, pseudo_variable_sites=0, otus=None, verbose=False):
+        """
+        otus - Only align this subset of OTUs (by seed ID), singletons are skipped.
+        """
+        import joblib
+        import pandas as pd
+
+        # Read the utmp file to get hits matching to seeds
+        # Retain only columns 0 (hits) and 1 (seeds). Set the index to the seed names
+        utmp = self._utmp_file(OTU_threshold)
 
         # Make a new tmp directory to contain the aligned fasta files
         # Force clean up the old directory if it exists
@@ -288,6 +489,7 @@ class BCI:
         # force seeds column to str to protect against OTU ids that are auto-detected as 'int'
         clusts.index = clusts.index.astype(str)
         # otus == the seed sequence IDs
+        subset = otus
         otus = set(clusts.index)
 
         # Get a data frame formatted with the zotu name as the index, like this:
@@ -295,18 +497,26 @@ class BCI:
         #   zotu2   AAGATCCT...
         seq_df = self._fasta_to_df()
 
-        for otu in otus:
+        # If the data were dereplicated, carry the number of copies of each unique
+        # sequence through to the aligned record names, so pi can be weighted
+        abundances = {} if self._abundances else None
+
+        for otu in otus if subset is None else subset:
             # Force zotu ids to be str to avoid conflict if zotu ids are auto-detected as int
             zids = np.append(clusts.loc[otu].values.astype(str), otu)
             seqs = seq_df.loc[zids].values
             with open(f"{tmp_fastadir}/{otu}.fasta", 'w') as outfile:
                 for idx, seq in enumerate(seqs):
                     outfile.write(f">{otu}_{idx}\n{seq}\n")
+                    if abundances is not None:
+                        abundances[f"{otu}_{idx}"] = self._abundances[zids[idx]]
 
         # Identify singleton sequences (unique sequences w/o any hits)
         # Singletons are any sequences in the seq_df that are NOT a hit or seed in the utmp file
         hits = np.append(clusts[0].values, list(otus))
         singletons = seq_df[~seq_df.index.isin(hits)]
+        # Singletons have nothing to align, skip them when aligning a subset
+        if subset is not None: singletons = singletons[[]]
 
         for zid, seq in singletons.items():
 
@@ -332,7 +542,7 @@ class BCI:
             self._muscle_cmds.append(' '.join(cmd))
 
         # Run all muscle commands in parallel
-        results = joblib.Parallel(n_jobs=20)(joblib.delayed(\
+        results = joblib.Parallel(n_jobs=self.cores)(joblib.delayed(\
                                     self._systemcall)(f) for f in self._muscle_cmds)
 
         # Gather all aligned fastas into one file
@@ -353,11 +563,13 @@ class BCI:
         with open(aligned, 'w') as outfile:
             outfile.write("".join(dat[1:]).strip())
 
-        return aligned
+        return aligned, abundances
 
 
     def _fasta_to_df(self):
-        seq_data = open(self.data).read().split()
+        import pandas as pd
+
+        seq_data = open(self._clust_data).read().split()
         ## Doing some formatting to make metadata and fasta zotu names agree:
         # Drop the leading >
         # Force all lowercase
@@ -394,10 +606,12 @@ class BCI:
 # FIXME: This should be in a util or stats package
 ###################
 
-    def _nucleotide_diversity(self, seqs, verbose=False):
+    def _nucleotide_diversity(self, seqs, counts=None, verbose=False):
         """
         Calculate nucleotide diversity from a list of sequences.
         `seqs` input should be a list of aligned sequences
+        `counts` optionally gives the number of copies of each sequence, so
+        dereplicated data gives the same pi as the full data
         """
         pi = 0
 
@@ -416,7 +630,13 @@ class BCI:
                 ## Enumerate the possible comparisons and for each
                 ## comparison calculate the number of pairwise differences,
                 ## summing over all sites in the sequence.
-                base_count = Counter(d)
+                if counts is None:
+                    base_count = Counter(d)
+                else:
+                    ## Allele counts weighted by the copies of each sequence
+                    base_count = Counter()
+                    for base, n in zip(d, counts):
+                        base_count[base] += n
                 ## ignore indels
                 del base_count["-"]
                 del base_count["N"]
@@ -475,6 +695,7 @@ class BCI:
             if np.any(abunds == 0):
                 # If any values are 0 (legal values for pi) then log flips out
                 # so fall back to the scipy.stats version
+                from scipy.stats import entropy
                 h = np.exp(entropy(abunds))
             else:
                 proportions = vals*(abunds/V_bar)
@@ -489,60 +710,13 @@ class BCI:
 # Utility functions
 ###################
 
-def plot_multi(bci_list, ax=None, log=True, normalize=False, plot_pis=False, cmap="Spectral", keyed_cmaps=None, **kwargs):
-    """
-    Plot multiple BCIs from different datasets
-
-    keyed_cmaps (dict) - Keys are substrings common to groups of samples
-                        (site name, habititat, etc), values are cmaps to use
-    """
-    if not ax:
-        fig, ax = plt.subplots(figsize=(8, 8))
-    else:
-        fig = ax.get_figure()
-
-    if keyed_cmaps:
-        # Use one coloramp for each group of samples keyed by identifiers in the sample names
-        cdict = {}
-        for k, v in keyed_cmaps.items():
-            bci_labels = [x.samp for x in bci_list if k in x.samp]
-            cmap = cm.get_cmap(v)(np.linspace(0.3, 0.9, len(bci_labels)))
-            cdict.update({x:cmap[i] for i, x in enumerate(bci_labels)})
-    else:
-        # use one colormap for all samples. linspace trims off the 'edges' of the cmap
-        # to make it only use colors that are readily visible against a white background
-        cmap = cm.get_cmap(cmap)(np.linspace(0.3, 0.9, len(bci_list)))
-        # Get a dictionary mapping bcis to evenly spaced color values in the cmap
-        bci_labels = [x.samp for x in bci_list]
-        cdict = {x:cmap[i] for i, x in enumerate(bci_labels)}
-
-        # Alternate method for sampling cmaps that samples the full range
-        #cmap = cm.get_cmap(cmap)
-        #bci_labels = [x.samp for x in bci_list]
-        #cdict = {x:cmap(i/len(bci_labels)) for i, x in enumerate(bci_labels)}
-
-    for bci in bci_list:
-        if plot_pis:
-            try:
-                data = np.array(sorted(bci.pis.values(), reverse=True))
-            except:
-                print("  BCI does not have pi data, giving up the plot.")
-                return None, None
-        else:
-            # Raw results for untransformed data will be saved in the results
-            # dict keyed by the sample name
-            # Why did I do this? It's not obvious why you wouldn't want to
-            # just plot the most recent run of the data. Here is what I was doing before:
-            # data = bci._results[bci.samp][0]
-            data = bci.bci
-            # log transform
-            data = np.log(data) if log else np.array(data)
-        # normalize
-        norm = data.sum() if normalize else 1
-        ax.plot(data/norm, label=bci.samp, color=cdict[bci.samp], lw=2, **kwargs)
-    #ax.legend(loc='upper right', bbox_to_anchor=(0.97, 0.97), labels=bci_labels)
-    plt.legend()
-    return fig, ax
+def __getattr__(name):
+    # plot_multi used to live here, keep `from BCI.BCI import plot_multi` working
+    # without importing matplotlib up front.
+    if name == "plot_multi":
+        from .plotting import plot_multi
+        return plot_multi
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def phylip_to_fasta(phylip, verbose=False):
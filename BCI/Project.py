@@ -3,7 +3,6 @@ import glob
 import gzip
 import numpy as np
 import os
-import pandas as pd
 import random
 import shutil
 import BCI
@@ -34,14 +33,19 @@ class Project:
 
         self.site_fastas = {}
         self.sitemap = {}
+        self.samples_per_site = {}
+        self._drop_duplicates = drop_duplicates
+        self._site_fastadir = os.path.join(self.project_dir, "site_fastas")
         if not sitemap == None:
             self.sitemap, self.samples_per_site = self._read_sitemap(sitemap)
-            self._site_fastadir = os.path.join(self.project_dir, "site_fastas")
 
             self.site_fastas = self._make_site_fastas(drop_duplicates=drop_duplicates, verbose=verbose)
 
         self.sample_bcis = {}
         self.site_bcis = {}
+        # Settings of the last call to run(), so BCIs recomputed by update()
+        # are comparable to the ones that are carried over
+        self._run_params = {}
 
 
     @property
@@ -55,6 +59,7 @@ class Project:
 
 
     def _read_asv_table(self, asv_table, verbose=False):
+        import pandas as pd
 
         asv_table = pd.read_csv(asv_table, index_col=0, sep=None, engine='python')
 
@@ -72,15 +77,22 @@ class Project:
 
 
     def _read_sitemap(self, sitemap):
+        import pandas as pd
+
         # Allow to auto-detect csv delimiter
         sitemap = pd.read_csv(sitemap, comment="#", names=["sample", "site"], sep=None, engine='python', dtype=str)
 
+        return sitemap, self._samples_per_site(sitemap)
+
+
+    def _samples_per_site(self, sitemap):
         group = sitemap.groupby(["site"])
-        samples_per_site = {site[0]: list(set(group["sample"])) for site, group in group}
-        return sitemap, samples_per_site
+        return {site[0]: list(set(group["sample"])) for site, group in group}
 
 
     def _read_fasta(self, fasta_file):
+        import pandas as pd
+
         if fasta_file.endswith((".gz", "gzip")):
             _open = gzip.open
             _flags = 'rt'
@@ -111,18 +123,22 @@ class Project:
             os.mkdir(self._sample_fastadir)
 
         sample_fastas = {}
-        for sample, zotus in self.zotus_per_sample.items():
-            fasta_data = self.seq_df.loc[zotus]
-            # Check fasta files should be this length
-            if verbose: print(site, len(fasta_data)*2)
-            sample_fasta = f"{self._sample_fastadir}/{sample}.fasta"
-            with open(sample_fasta, 'w') as outfile:
-                for k, v in fasta_data.items():
-                    outfile.write(f">{k}\n{v}\n")
-            sample_fastas[sample] = sample_fasta
+        for sample in self.zotus_per_sample:
+            sample_fastas[sample] = self._write_sample_fasta(sample, verbose=verbose)
         return sample_fastas
 
 
+    def _write_sample_fasta(self, sample, verbose=False):
+        fasta_data = self.seq_df.loc[self.zotus_per_sample[sample]]
+        # Check fasta files should be this length
+        if verbose: print(sample, len(fasta_data)*2)
+        sample_fasta = f"{self._sample_fastadir}/{sample}.fasta"
+        with open(sample_fasta, 'w') as outfile:
+            for k, v in fasta_data.items():
+                outfile.write(f">{k}\n{v}\n")
+        return sample_fasta
+
+
     def _make_site_fastas(self, subset_samples=None, drop_duplicates=False, verbose=False):
         if os.path.exists(self._site_fastadir):
             shutil.rmtree(self._site_fastadir)
@@ -131,68 +147,227 @@ class Project:
 
         site_fastas = {}
         for site, samples in self.samples_per_site.items():
-            site = site.replace(" ", "_")
-            site_fasta = f"{self._site_fastadir}/{site}.fasta"
             # Standardize sampling to n random samples per site 
             if subset_samples:
                 samples = np.random.choice(samples, subset_samples, replace=False)
-            # Accumulate ASV fasta data across all samples
-            fasta_data = []
-            for sample in samples:
-                zotus = self.zotus_per_sample[sample]
-                fasta_data.append(self.seq_df.loc[zotus])
-            # Join all ASVs across samples into one Series
-            fasta_data = pd.concat(fasta_data)
-            # If there are duplicate ASVs among sites remove these before clustering
-            if drop_duplicates:
-                fasta_data = fasta_data.drop_duplicates()
-            with open(site_fasta, 'a') as outfile:
-                for k, v in fasta_data.items():
-                    outfile.write(f">{k}\n{v}\n")
-            site_fastas[site] = site_fasta
+            site_fastas[site] = self._write_site_fasta(site, samples, drop_duplicates=drop_duplicates)
         return site_fastas
 
 
-    def run(self, samples=True, sites=True, resample=None, verbose=False):
+    def _write_site_fasta(self, site, samples, drop_duplicates=False):
+        import pandas as pd
+
+        # site_fastas is keyed by site name, only the file name drops spaces
+        site_fasta = f"{self._site_fastadir}/{site.replace(' ', '_')}.fasta"
+        # Accumulate ASV fasta data across all samples
+        fasta_data = []
+        for sample in samples:
+            zotus = self.zotus_per_sample[sample]
+            fasta_data.append(self.seq_df.loc[zotus])
+        # Join all ASVs across samples into one Series
+        fasta_data = pd.concat(fasta_data)
+        # If there are duplicate ASVs among sites remove these before clustering
+        if drop_duplicates:
+            fasta_data = fasta_data.drop_duplicates()
+        with open(site_fasta, 'w') as outfile:
+            for k, v in fasta_data.items():
+                outfile.write(f">{k}\n{v}\n")
+        return site_fasta
+
+
+    def run(self, samples=True, sites=True, resample=None, dereplicate=False, approximate=False,
+            pi_estimator="alignment", verbose=False):
+        """
+        dereplicate (bool) - Collapse identical sequences into unique records with
+                             counts before clustering (see BCI). Site fastas built
+                             with drop_duplicates=False then weight pi by the number
+                             of samples each ASV occurs in.
+        approximate (bool) - Estimate BCIs from MinHash sketches instead of exact
+                             clustering, for quick screening (see BCI.sketch)
+        pi_estimator (str) - 'alignment' or 'identity', how to calculate per OTU pi
+                             (see BCI.nucleotide_diversity)
+        """
+        # Keep the selection of samples/sites (True for all, or a list) so
+        # update() only recomputes BCIs for the ones run() processed
+        self._run_params = {"samples":samples if samples is True else list(samples or []),
+                            "sites":sites if sites is True else list(sites or []),
+                            "resample":resample,
+                            "dereplicate":dereplicate,
+                            "approximate":approximate,
+                            "pi_estimator":pi_estimator}
         if samples:
             self.sample_bcis = {}
             if samples == True: samples = self.samples
             print(f"  Processing {len(samples)} samples.")
-            for sample in samples:
-                if verbose: print(sample)
-                self.sample_bcis[sample] = BCI.BCI(data=self.sample_fastas[sample], verbose=verbose)
-                self.sample_bcis[sample]._min_clust_threshold = 70
-                if resample:
-                    self.sample_bcis[sample].transform(transformation="resample", count=resample)
-                self.sample_bcis[sample].run()
+            self._run_samples(samples, verbose=verbose)
 
         # Only process sites if self.sitemap has been loaded
         if sites and len(self.sitemap):
             self.site_bcis = {}
             if sites == True: sites = self.sites
             print(f"  Processing {len(sites)} sites.")
-            for site in sites:
-                if verbose: print(site)
-                self.site_bcis[site] = BCI.BCI(data=self.site_fastas[site], verbose=verbose)
-                self.site_bcis[site]._min_clust_threshold = 70
-                if resample:
-                    self.site_bcis[site].transform(transformation="resample", count=resample)
-                self.site_bcis[site].run()
+            self._run_sites(sites, verbose=verbose)
+
+
+    def _run_samples(self, samples, verbose=False):
+        for sample in samples:
+            if verbose: print(sample)
+            self.sample_bcis[sample] = self._run_bci(self.sample_fastas[sample], verbose=verbose)
+
+
+    def _run_sites(self, sites, verbose=False):
+        for site in sites:
+            if verbose: print(site)
+            self.site_bcis[site] = self._run_bci(self.site_fastas[site], verbose=verbose)
+
+
+    def _run_bci(self, data, verbose=False):
+        resample = self._run_params.get("resample")
+        bci = BCI.BCI(data=data,
+                        dereplicate=self._run_params.get("dereplicate", False),
+                        approximate=self._run_params.get("approximate", False),
+                        pi_estimator=self._run_params.get("pi_estimator", "alignment"),
+                        verbose=verbose)
+        bci._min_clust_threshold = 70
+        if resample:
+            bci.transform(transformation="resample", count=resample)
+        bci.run()
+        return bci
+
+
+    def update(self, asv_table=None, fasta_file=None, sitemap=None, run=True, verbose=False):
+        """
+        Add new samples, sequences and/or sitemap entries to the project without
+        rebuilding it. Only the sample and site fastas whose ASV sets changed are
+        rewritten, and only their BCIs are recomputed (with the same settings as
+        the last call to run()). BCIs of unchanged samples and sites are kept.
+
+        asv_table - ASV table with new sample columns. Columns for samples that are
+                    already in the project replace the old ones.
+        fasta_file - Fasta file with new sequences. Sequences with IDs that are
+                     already in the project replace the old ones.
+        sitemap - Sitemap with new sample/site entries. A sample that is already
+                  in the sitemap is moved to the new site.
+        run - Recompute the BCIs of changed samples and sites. If False they are
+              dropped from sample_bcis/site_bcis and can be recomputed by run().
+
+        Returns lists of the changed samples and changed sites. Sites left with
+        no samples are removed (with their fasta and BCI) and also returned as
+        changed.
+        """
+        import pandas as pd
+
+        old_zotus = {k:set(v) for k, v in self.zotus_per_sample.items()}
+        old_sites = {k:set(v) for k, v in self.samples_per_site.items()}
+
+        changed_seqs = set()
+        if fasta_file is not None:
+            new_seqs = self._read_fasta(fasta_file)
+            common = new_seqs.index.intersection(self.seq_df.index)
+            changed_seqs = set(common[new_seqs[common] != self.seq_df[common]])
+            self.seq_df = pd.concat([self.seq_df.drop(common), new_seqs])
+
+        if asv_table is not None:
+            new_table, new_zotus = self._read_asv_table(asv_table)
+            asv_table = self.asv_table.drop(columns=new_table.columns, errors="ignore")
+            # New ASVs are absent (0) from the samples already in the table. The
+            # missing values make concat upcast counts to float, so cast back.
+            dtype = np.result_type(*asv_table.dtypes, *new_table.dtypes)
+            self.asv_table = pd.concat([asv_table, new_table], axis=1).fillna(0).astype(dtype)
+            self.zotus_per_sample.update(new_zotus)
+
+        if sitemap is not None:
+            new_sitemap, _ = self._read_sitemap(sitemap)
+            if len(self.sitemap):
+                new_sitemap = pd.concat([self.sitemap, new_sitemap])\
+                                .drop_duplicates(subset="sample", keep="last")
+            self.sitemap = new_sitemap
+            self.samples_per_site = self._samples_per_site(self.sitemap)
+
+        changed_samples = [x for x, zotus in self.zotus_per_sample.items()
+                            if old_zotus.get(x) != set(zotus) or changed_seqs & set(zotus)]
+        for sample in changed_samples:
+            self.sample_fastas[sample] = self._write_sample_fasta(sample, verbose=verbose)
+            self.sample_bcis.pop(sample, None)
+
+        changed_sites = [x for x, samples in self.samples_per_site.items()
+                            if old_sites.get(x) != set(samples) or set(samples) & set(changed_samples)]
+        if changed_sites and not os.path.exists(self._site_fastadir):
+            os.mkdir(self._site_fastadir)
+        for site in changed_sites:
+            self.site_fastas[site] = self._write_site_fasta(site,
+                                                            self.samples_per_site[site],
+                                                            drop_duplicates=self._drop_duplicates)
+            self.site_bcis.pop(site, None)
+
+        # Sites that lost all their samples to other sites
+        removed_sites = [x for x in old_sites if x not in self.samples_per_site]
+        for site in removed_sites:
+            site_fasta = self.site_fastas.pop(site, None)
+            if site_fasta and os.path.exists(site_fasta):
+                os.remove(site_fasta)
+            self.site_bcis.pop(site, None)
+
+        msg = f"  Updated {len(changed_samples)} samples and {len(changed_sites)} sites"
+        if removed_sites:
+            msg += f", removed {len(removed_sites)} empty sites"
+        print(msg + ".")
+        if run and self._run_params:
+            self._run_samples(self._selected(changed_samples, self._run_params["samples"]),
+                                verbose=verbose)
+            if len(self.sitemap):
+                self._run_sites(self._selected(changed_sites, self._run_params["sites"]),
+                                verbose=verbose)
+
+        return changed_samples, changed_sites + removed_sites
+
+
+    def _selected(self, names, selection):
+        """
+        The members of `names` in a run() selection (True for all).
+        """
+        if selection is True:
+            return names
+        return [x for x in names if x in selection]
 
 
     def plot_samples(self, include=None, exclude=None):
         pass
 
 
-    def plot_sites(self, ax=None, include=None, exclude=None, log=True, plot_pis=False, cmaps=None):
+    def plot_sites(self, ax=None, include=None, exclude=None, log=True, plot_pis=False, cmaps=None,
+                    summary=False, rasterized=None):
+        """
+        cmaps (dict) - Keys are colormaps, values are lists of sites to plot with
+                       each colormap. All sites are drawn in one pass so colors are
+                       only computed once, and each colormap is one group for the
+                       `summary` median/quantile bands. Groups are labelled in the
+                       legend by their sites, not by the colormap name.
+        """
         if cmaps == None:
             cmaps = {"Spectral":self.site_bcis.keys()}
+            labels = {"Spectral":"All sites"}
+        else:
+            labels = {cmap:self._group_label(sites) for cmap, sites in cmaps.items()}
+            # Two groups of the same sites still need distinct labels
+            if len(set(labels.values())) < len(labels):
+                labels = {cmap:f"{label} ({cmap})" for cmap, label in labels.items()}
 
-        for cmap, sites in cmaps.items():
-            fig, ax = BCI.plot_multi([self.site_bcis[x] for x in sites],
-                   ax=ax, cmap=cmap, log=log, normalize=False, plot_pis=plot_pis)
+        bci_groups = {labels[cmap]:[self.site_bcis[x] for x in sites] for cmap, sites in cmaps.items()}
+        fig, ax = BCI.plotting.plot_groups(bci_groups, ax=ax, cmaps={labels[x]:x for x in cmaps},
+                                            log=log, normalize=False, plot_pis=plot_pis,
+                                            summary=summary, rasterized=rasterized)
 
         return fig, ax
 
 
-
+    def _group_label(self, sites, max_sites=3):
+        """
+        Legend label for a group of sites, the first `max_sites` site names
+        and the number of others.
+        """
+        sites = list(sites)
+        label = ", ".join(str(x) for x in sites[:max_sites])
+        if len(sites) > max_sites:
+            label += f" (+{len(sites) - max_sites} more)"
+        return label
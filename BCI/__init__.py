@@ -1,5 +1,19 @@
 __version__ = "0.0.2"
 __author__ = "Isaac Overcast"
 
-from .BCI import BCI, plot_multi, phylip_to_fasta
+from .BCI import BCI, phylip_to_fasta
 from .Project import Project
+from .pipeline import simulation_features, load_simulation_features
+
+# Plotting pulls in matplotlib, which dominates import time, so it is only
+# loaded on first access of `BCI.plotting` or `BCI.plot_multi`.
+_lazy_plotting = {"plot_multi"}
+
+
+def __getattr__(name):
+    import importlib
+    if name == "plotting":
+        return importlib.import_module(".plotting", __name__)
+    if name in _lazy_plotting:
+        return getattr(importlib.import_module(".plotting", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,206 @@
+"""
+Batch pipeline from simulated fasta files to summary statistics.
+
+Each simulation is run through BCI.run(simulated=True) in a pool of worker
+processes and reduced to one row of features: the BCI vector, the Hill
+numbers of the simulated species pis and of the OTU pis, and the simulation
+parameters (if provided). Features for each simulation are written to their
+own file in `outdir` as soon as it finishes, so an interrupted batch picks up
+where it left off when re-run. A simulation that fails writes its traceback to
+`<sim>.error` instead and the batch carries on. Failed simulations are skipped
+when the batch is re-run, unless `retry_failed=True`. Each worker clusters in
+its own scratch directory which is removed as soon as the simulation is done,
+so scratch usage is bounded by the number of workers rather than the number of
+simulations.
+"""
+import glob
+import os
+import shutil
+import traceback
+
+from .BCI import BCI
+
+FEATURES_SUFFIX = ".features.csv"
+ERROR_SUFFIX = ".error"
+# Feature column names start with these, followed by the threshold or Hill order
+FEATURE_PREFIXES = ("bci_", "sim_pi_h", "otu_pi_h")
+
+
+def _list_simulations(sims):
+    """
+    Get the list of fasta files from a directory, glob pattern or list of files.
+    """
+    if isinstance(sims, str):
+        if os.path.isdir(sims):
+            sims = glob.glob(os.path.join(sims, "*.fasta"))
+        else:
+            sims = glob.glob(sims)
+    return sorted(sims)
+
+
+def _features_file(fasta, outdir):
+    return os.path.join(outdir, os.path.basename(fasta).rsplit(".", 1)[0] + FEATURES_SUFFIX)
+
+
+def _error_file(fasta, outdir):
+    return os.path.join(outdir, os.path.basename(fasta).rsplit(".", 1)[0] + ERROR_SUFFIX)
+
+
+def _simulation_features(fasta,
+                            outfile,
+                            scratch_dir,
+                            params=None,
+                            min_clust_threshold=70,
+                            dereplicate=False,
+                            pi_estimator="alignment",
+                            cores=1):
+    """
+    Run one simulation and write its features to `outfile`. Runs in a worker.
+    If the simulation fails the traceback is written to `<sim>.error` next to
+    `outfile` and None is returned, so one bad simulation doesn't take the
+    rest of the batch down with it.
+    """
+    import numpy as np
+    import pandas as pd
+
+    sim = os.path.basename(fasta).rsplit(".", 1)[0]
+    errfile = outfile[:-len(FEATURES_SUFFIX)] + ERROR_SUFFIX
+    # Private scratch space for this simulation
+    tmpdir = os.path.join(scratch_dir, sim)
+    os.makedirs(tmpdir, exist_ok=True)
+    try:
+        bci = BCI(data=fasta, project_dir=tmpdir, dereplicate=dereplicate, pi_estimator=pi_estimator)
+        bci._min_clust_threshold = min_clust_threshold
+        bci._vsearch_threads = 1
+        bci.cores = cores
+        bci.run(simulated=True)
+
+        feats = {"sim":sim}
+        feats.update({f"bci_{tol:.2f}":n for tol, n in zip(bci.tols, bci.bci)})
+        # Empty simulations (no OTU diversity) don't get pis, record nan
+        sim_pis = list(getattr(bci, "sim_pis", {}).values())
+        sim_hills = [bci._generalized_hill_number(sim_pis, order=x) for x in range(4)]\
+                        if sim_pis else [np.nan]*4
+        otu_hills = getattr(bci, "hill_numbers", [np.nan]*4)
+        feats.update({f"sim_pi_h{x}":h for x, h in enumerate(sim_hills)})
+        feats.update({f"otu_pi_h{x}":h for x, h in enumerate(otu_hills)})
+        if params:
+            feats.update(params)
+    except Exception:
+        with open(errfile, 'w') as errout:
+            errout.write(traceback.format_exc())
+        return None
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # Write to a temp file and move it into place so an interrupted write
+    # never leaves a partial checkpoint behind
+    pd.DataFrame([feats]).to_csv(outfile + ".tmp", index=False)
+    os.replace(outfile + ".tmp", outfile)
+    if os.path.exists(errfile):
+        os.remove(errfile)
+    return outfile
+
+
+def simulation_features(sims,
+                        outdir,
+                        params=None,
+                        scratch_dir=None,
+                        n_jobs=4,
+                        min_clust_threshold=70,
+                        dereplicate=False,
+                        pi_estimator="alignment",
+                        overwrite=False,
+                        retry_failed=False,
+                        verbose=False):
+    """
+    Calculate features for a batch of simulations in parallel.
+
+    sims - A directory of simulated fasta files, a glob pattern, or a list of
+           fasta files.
+    outdir - Directory to write one `<sim>.features.csv` file per simulation.
+             Simulations that already have a features file are skipped, so an
+             interrupted batch can be resumed by running the same command.
+    params - Optional DataFrame (or path to a csv file) of simulation parameters,
+             indexed by simulation name (the fasta file name without extension).
+             Columns are added to the features, so they can't be named `sim` or
+             start with `bci_`, `sim_pi_h` or `otu_pi_h`.
+    scratch_dir - Where workers cluster and align, defaults to `outdir`/.scratch.
+                  Each worker uses one subdirectory that is removed when it
+                  finishes, so at most `n_jobs` simulations use scratch at once.
+    n_jobs - Number of simulations to run in parallel.
+    pi_estimator - 'alignment' or 'identity', how to calculate OTU pis (see
+                   BCI.nucleotide_diversity). 'identity' skips most alignments.
+    overwrite - Recalculate features even if the features file exists.
+    retry_failed - Rerun simulations that failed in a previous batch (they
+                   have a `<sim>.error` file in `outdir` holding the traceback).
+                   By default they are skipped.
+
+    Returns a DataFrame of the features for all simulations in `outdir` (see
+    load_simulation_features).
+    """
+    import joblib
+    import pandas as pd
+
+    os.makedirs(outdir, exist_ok=True)
+    default_scratch = scratch_dir is None
+    if default_scratch:
+        scratch_dir = os.path.join(outdir, ".scratch")
+    os.makedirs(scratch_dir, exist_ok=True)
+
+    if isinstance(params, str):
+        params = pd.read_csv(params, index_col=0, sep=None, engine='python')
+    if params is not None:
+        params.index = params.index.astype(str)
+        # Parameters are merged into the feature rows, don't let them replace features
+        clash = [x for x in params.columns if str(x) == "sim" or str(x).startswith(FEATURE_PREFIXES)]
+        if clash:
+            raise ValueError(f"  params columns clash with feature names, rename them: {clash}")
+
+    fastas = _list_simulations(sims)
+    todo = [x for x in fastas if overwrite or not os.path.exists(_features_file(x, outdir))]
+    # Simulations that failed in a previous batch
+    skip = set() if overwrite or retry_failed else\
+                {x for x in todo if os.path.exists(_error_file(x, outdir))}
+    todo = [x for x in todo if x not in skip]
+    msg = f"  Processing {len(todo)} simulations ({len(fastas) - len(todo) - len(skip)} already done"
+    if skip:
+        msg += f", skipping {len(skip)} that failed before, retry them with retry_failed=True"
+    print(msg + ").")
+
+    def _params(fasta):
+        sim = os.path.basename(fasta).rsplit(".", 1)[0]
+        if params is None or sim not in params.index:
+            return None
+        return params.loc[sim].to_dict()
+
+    # Generator of tasks so only a few are queued ahead of the workers
+    tasks = (joblib.delayed(_simulation_features)(fasta,
+                                                    _features_file(fasta, outdir),
+                                                    scratch_dir,
+                                                    params=_params(fasta),
+                                                    min_clust_threshold=min_clust_threshold,
+                                                    dereplicate=dereplicate,
+                                                    pi_estimator=pi_estimator)
+                for fasta in todo)
+    results = joblib.Parallel(n_jobs=n_jobs, verbose=10 if verbose else 0)(tasks)
+    nfailed = sum(x is None for x in results)
+    if nfailed:
+        print(f"  {nfailed} simulations failed, see the {ERROR_SUFFIX} files in {outdir}.")
+
+    if default_scratch:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return load_simulation_features(outdir)
+
+
+def load_simulation_features(outdir):
+    """
+    Gather the per simulation features files in `outdir` into one DataFrame
+    indexed by simulation name.
+    """
+    import pandas as pd
+
+    files = sorted(glob.glob(os.path.join(outdir, "*" + FEATURES_SUFFIX)))
+    if not files:
+        return pd.DataFrame()
+    return pd.concat([pd.read_csv(x) for x in files], ignore_index=True).set_index("sim")
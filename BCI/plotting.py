@@ -0,0 +1,311 @@
+"""
+Plotting functions for BCI results.
+
+This module is imported lazily (on first access of `BCI.plot_multi` or a call
+to `BCI.plot()`) so that matplotlib is not loaded by `import BCI`.
+
+Multi-curve plots draw each group of curves as a single LineCollection rather
+than one Line2D per curve, so plotting thousands of BCIs stays fast and the
+resulting vector files stay small. Extra keyword arguments are Line2D
+properties as for `ax.plot`; ones a LineCollection can't draw (e.g. `marker`)
+fall back to one line per curve.
+"""
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import cbook
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+# Rasterize the curve layers automatically above this many curves
+RASTERIZE_MIN_CURVES = 100
+# Draw one legend entry per curve up to this many curves, otherwise one per group
+MAX_LEGEND_CURVES = 20
+
+
+def _get_cmap(cmap):
+    """
+    Resolve a colormap name (or Colormap instance) without the deprecated
+    `cm.get_cmap`.
+    """
+    if isinstance(cmap, matplotlib.colors.Colormap):
+        return cmap
+    return matplotlib.colormaps[cmap]
+
+
+def group_colors(groups, cmaps="Spectral", lo=0.3, hi=0.9):
+    """
+    Compute curve colors for all groups at once.
+
+    groups (dict) - Maps group names to lists of curve labels
+    cmaps (str/dict) - One colormap for all groups, or a dict mapping group
+                       names to colormaps
+
+    Returns a dict mapping each curve label to an RGBA color and a dict
+    mapping each group name to a single representative color. If one cmap is
+    shared by all groups the curves are spread evenly across it, otherwise
+    each group spreads its own curves across its own cmap. linspace trims off
+    the 'edges' of the cmap to make it only use colors that are readily visible
+    against a white background.
+    """
+    cdict = {}
+    gdict = {}
+    if isinstance(cmaps, dict):
+        for group, labels in groups.items():
+            cmap = _get_cmap(cmaps[group])
+            colors = cmap(np.linspace(lo, hi, len(labels)))
+            cdict.update({x:colors[i] for i, x in enumerate(labels)})
+            gdict[group] = cmap((lo + hi)/2)
+    else:
+        cmap = _get_cmap(cmaps)
+        labels = [x for group in groups.values() for x in group]
+        colors = cmap(np.linspace(lo, hi, len(labels)))
+        cdict = {x:colors[i] for i, x in enumerate(labels)}
+        gpos = np.linspace(lo, hi, len(groups))
+        gdict = {group:cmap(gpos[i]) for i, group in enumerate(groups)}
+    return cdict, gdict
+
+
+def _bci_curve(bci, log=True, normalize=False, plot_pis=False):
+    """
+    Get the array of values to plot for one BCI, or None if it has no pi data
+    and `plot_pis` is set.
+    """
+    if plot_pis:
+        try:
+            data = np.array(sorted(bci.pis.values(), reverse=True))
+        except:
+            return None
+    else:
+        # Raw results for untransformed data will be saved in the results
+        # dict keyed by the sample name
+        # Why did I do this? It's not obvious why you wouldn't want to
+        # just plot the most recent run of the data. Here is what I was doing before:
+        # data = bci._results[bci.samp][0]
+        data = bci.bci
+        # log transform
+        data = np.log(data) if log else np.array(data)
+    # normalize
+    norm = data.sum() if normalize else 1
+    return data/norm
+
+
+def _pad_curves(curves):
+    """
+    Stack curves of possibly different lengths into a 2D array padded with nan.
+    """
+    maxlen = max(len(x) for x in curves)
+    arr = np.full((len(curves), maxlen), np.nan)
+    for i, y in enumerate(curves):
+        arr[i, :len(y)] = y
+    return arr
+
+
+def _plot_curve_groups(ax,
+                        curves,
+                        colors,
+                        group_colors,
+                        summary=False,
+                        quantiles=(0.05, 0.95),
+                        rasterized=None,
+                        legend=True,
+                        **kwargs):
+    """
+    Draw groups of curves on `ax`.
+
+    curves (dict) - Maps group names to dicts of {curve label: array}
+    colors (dict) - Maps curve labels to colors
+    group_colors (dict) - Maps group names to colors, used for summaries and
+                          group level legend entries
+    summary (bool) - Draw the median and a quantile band per group instead of
+                     the individual curves
+    quantiles (tuple) - Lower and upper quantiles of the summary band
+    rasterized (bool) - Rasterize the dense layers (curves and bands). If None
+                        rasterize when there are more than RASTERIZE_MIN_CURVES
+                        curves.
+    """
+    ncurves = sum(len(x) for x in curves.values())
+    if rasterized is None:
+        rasterized = ncurves > RASTERIZE_MIN_CURVES
+    # kwargs are Line2D properties (as for ax.plot), resolve aliases (lw etc)
+    # before setting the default so `linewidth=1` doesn't clash with it
+    kwargs = cbook.normalize_kwargs(kwargs, Line2D)
+    kwargs.setdefault("linewidth", 2)
+    # Line2D only properties (markers, drawstyle, ...) can't be drawn by a
+    # LineCollection, fall back to one line per curve for those
+    collection = all(hasattr(LineCollection, f"set_{x}") for x in kwargs)
+
+    handles = []
+    for group, gcurves in curves.items():
+        if not gcurves: continue
+        if summary:
+            arr = _pad_curves(list(gcurves.values()))
+            x = np.arange(arr.shape[1])
+            lower, upper = np.nanquantile(arr, quantiles, axis=0)
+            ax.fill_between(x, lower, upper, color=group_colors[group],
+                            alpha=0.3, lw=0, rasterized=rasterized)
+            ax.plot(x, np.nanmedian(arr, axis=0), color=group_colors[group], **kwargs)
+        elif collection:
+            segs = [np.column_stack([np.arange(len(y)), y]) for y in gcurves.values()]
+            lc = LineCollection(segs,
+                                colors=[colors[x] for x in gcurves],
+                                rasterized=rasterized,
+                                **kwargs)
+            ax.add_collection(lc)
+        else:
+            for x, y in gcurves.items():
+                ax.plot(y, color=colors[x], rasterized=rasterized, **kwargs)
+        if not summary and ncurves <= MAX_LEGEND_CURVES:
+            handles.extend([Line2D([], [], color=colors[x], label=x) for x in gcurves])
+        else:
+            handles.append(Line2D([], [], color=group_colors[group], label=group))
+    ax.autoscale_view()
+    if legend and handles:
+        ax.legend(handles=handles, loc='upper right', bbox_to_anchor=(0.97, 0.97))
+
+
+def plot_bci(bci, ax=None, log=True, normalize=False, plot_pis=False, **kwargs):
+    if not ax:
+        fig, ax = plt.subplots(figsize=(8, 8))
+    fig = ax.get_figure()
+
+    if plot_pis:
+        try:
+            dat = np.array(sorted(bci.pis.values(), reverse=True))
+        except:
+            print("  BCI does not have pi data, giving up the plot.")
+            return None, None
+    else:
+        # log transform (pis have 0 values so don't like log'ing
+        dat = np.log(bci.bci) if log else np.array(bci.bci)
+
+    # normalize
+    norm = dat.sum() if normalize else 1
+    ax.plot(np.array(dat)/norm, label=bci._label, **kwargs)
+    ax.legend(loc='upper right', bbox_to_anchor=(0.97, 0.97))
+    return fig, ax
+
+
+def plot_results(bci,
+                    ax=None,
+                    log=True,
+                    normalize=False,
+                    cmap="Spectral",
+                    summary=False,
+                    quantiles=(0.05, 0.95),
+                    rasterized=None,
+                    **kwargs):
+    """
+    Plot all the stored results for one BCI, with one color and one legend
+    entry per transformation label.
+    """
+    if not ax:
+        fig, ax = plt.subplots(figsize=(8, 8))
+    fig = ax.get_figure()
+
+    # Get a dictionary mapping labels to evenly spaced color values in the cmap
+    cmap = _get_cmap(cmap)
+    cdict = {k:cmap(i/len(bci._results)) for i, k in enumerate(bci._results.keys())}
+
+    curves = {}
+    colors = {}
+    for label, results in bci._results.items():
+        curves[label] = {}
+        for i, res in enumerate(results):
+            # log transform
+            dat = np.log(res) if log else np.array(res)
+            # normalize
+            norm = dat.sum() if normalize else 1
+            curves[label][(label, i)] = dat/norm
+            colors[(label, i)] = cdict[label]
+
+    # One legend entry per label, regardless of the number of replicates
+    _plot_curve_groups(ax, curves, colors, cdict, summary=summary, quantiles=quantiles,
+                        rasterized=rasterized, legend=False, **kwargs)
+    handles = [Line2D([], [], color=cdict[x], label=x) for x in curves]
+    ax.legend(handles=handles, loc='upper right', bbox_to_anchor=(0.97, 0.97))
+    return fig, ax
+
+
+def plot_groups(bci_groups,
+                ax=None,
+                log=True,
+                normalize=False,
+                plot_pis=False,
+                cmaps="Spectral",
+                summary=False,
+                quantiles=(0.05, 0.95),
+                rasterized=None,
+                **kwargs):
+    """
+    Plot groups of BCIs, batching each group into a single line collection.
+
+    bci_groups (dict) - Maps group names (site, habitat, etc) to lists of BCIs
+    cmaps (str/dict) - One colormap for all groups, or a dict mapping group
+                       names to colormaps
+    summary (bool) - Plot the median and `quantiles` band per group rather
+                     than every curve
+    rasterized (bool) - Rasterize the dense layers. Defaults to rasterizing
+                        when plotting more than RASTERIZE_MIN_CURVES curves.
+    """
+    if not ax:
+        fig, ax = plt.subplots(figsize=(8, 8))
+    else:
+        fig = ax.get_figure()
+
+    curves = {}
+    for group, bcis in bci_groups.items():
+        curves[group] = {}
+        for bci in bcis:
+            data = _bci_curve(bci, log=log, normalize=normalize, plot_pis=plot_pis)
+            if data is None:
+                print("  BCI does not have pi data, giving up the plot.")
+                return None, None
+            curves[group][bci.samp] = data
+
+    cdict, gdict = group_colors({k:list(v) for k, v in curves.items()}, cmaps=cmaps)
+    _plot_curve_groups(ax, curves, cdict, gdict, summary=summary, quantiles=quantiles,
+                        rasterized=rasterized, **kwargs)
+    return fig, ax
+
+
+def plot_multi(bci_list,
+                ax=None,
+                log=True,
+                normalize=False,
+                plot_pis=False,
+                cmap="Spectral",
+                keyed_cmaps=None,
+                summary=False,
+                quantiles=(0.05, 0.95),
+                rasterized=None,
+                **kwargs):
+    """
+    Plot multiple BCIs from different datasets
+
+    keyed_cmaps (dict) - Keys are substrings common to groups of samples
+                        (site name, habititat, etc), values are cmaps to use.
+                        Each sample is assigned to the first key it contains,
+                        samples matching no key are not plotted.
+    summary (bool) - Plot the median and `quantiles` band per group (per key
+                     of `keyed_cmaps`, or all samples together) rather than
+                     every curve
+    rasterized (bool) - Rasterize the dense layers. Defaults to rasterizing
+                        when plotting more than RASTERIZE_MIN_CURVES curves.
+    """
+    if keyed_cmaps:
+        # Use one colormap for each group of samples keyed by identifiers in the sample names
+        bci_groups = {k:[] for k in keyed_cmaps}
+        for bci in bci_list:
+            key = next((k for k in keyed_cmaps if k in bci.samp), None)
+            if key is not None:
+                bci_groups[key].append(bci)
+        cmaps = keyed_cmaps
+    else:
+        # use one colormap for all samples
+        bci_groups = {"all":bci_list}
+        cmaps = cmap
+
+    return plot_groups(bci_groups, ax=ax, log=log, normalize=normalize, plot_pis=plot_pis,
+                        cmaps=cmaps, summary=summary, quantiles=quantiles,
+                        rasterized=rasterized, **kwargs)
@@ -0,0 +1,425 @@
+"""
+Approximate BCI from MinHash sketches.
+
+Instead of aligning every sequence against every seed at each clustering
+threshold (vsearch -cluster_smallmem), each unique sequence is reduced to a
+MinHash sketch of its k-mers and greedy clustering is done in sketch space.
+The k-mer Jaccard similarity J between two sequences is estimated by the
+fraction of matching sketch values, and an identity threshold t is converted
+to a Jaccard threshold assuming a fraction t**k of k-mers survive the
+differences, plus the fraction of k-mers expected to be shared by chance given
+the base composition and sequence length of the input. All thresholds are
+clustered in a single pass over the data, in input order (like -usersort).
+
+Sequences are streamed in batches. Each batch is sketched in one vectorized
+pass using one permutation hashing (one hash per k-mer, the sketch is the
+minimum in each of `sketch_size` bins, empty bins are filled from the next
+non-empty bin), and then compared to the seeds of all previous batches at
+once. At high thresholds candidate seeds come from a banded LSH index of the
+seed sketches, which finds a seed at the Jaccard threshold with probability
+>= LSH_RECALL. Lower thresholds have few seeds, and these are compared to
+every seed. Only the sequences that are a new seed at some threshold are then
+clustered one at a time against the seeds of their own batch.
+
+Error bounds: with the defaults k=8 and sketch_size=256 the relative error of
+the cluster counts is within ERROR_BOUNDS at thresholds from 0.99 to 0.85.
+Counts at 1.00 are the number of unique sequences. Below 0.85 the assumption
+that differences are spread evenly along the sequence breaks down, too many
+k-mers survive and the number of clusters is underestimated by 25-50% down to
+0.76, while the last few clusters (0.75-0.71) are off by up to 300%. There is
+no bound for these thresholds and BCI.run warns when asked for them. Use
+approximate mode for screening and exact mode for final analyses.
+
+The bounds are NOT yet measured against exact (vsearch) mode. They were
+measured against an alignment proxy: greedy clustering of the Salces-Castellano
+et al (2021) Canary Island beetle COI data (empirical-examples/, 3995
+sequences, 2216 unique), in file order and four random orders, in which
+identity is the fraction of matching columns of the given alignment, ignoring
+terminal gaps (vsearch's default definition, but without vsearch's pairwise
+alignment). Whether vsearch -id 1.0 gives the number of unique sequences is
+also unchecked. The proxy counts are in tests/data and checked by
+tests/test_sketch.py. To measure against vsearch run
+
+    python benchmarks/sketch_error.py --reference vsearch --write tests/data/canary_beetles_vsearch_counts.tsv
+
+which reports the error at each threshold, and re-derive ERROR_BOUNDS from it.
+tests/test_sketch.py then also checks the bounds against the vsearch counts.
+"""
+import itertools
+
+import numpy as np
+
+# Maximum relative error of approximate vs reference cluster counts (the
+# alignment proxy, see above), keyed by the lowest identity threshold each
+# bound applies to. Thresholds below the lowest key have no bound. Checked by
+# tests/test_sketch.py and benchmarks/sketch_error.py
+ERROR_BOUNDS = {0.88: 0.10, 0.85: 0.15}
+
+# Probability that an LSH index finds a seed whose sketch similarity is at
+# the Jaccard threshold. Thresholds no index can reach with this recall
+# compare each query to all of their seeds instead.
+LSH_RECALL = 0.999
+
+# Map bases to 2-bit codes, everything else (gaps, N, ambiguity codes) to 255
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for _i, _b in enumerate(b"ACGT"):
+    _BASE_CODES[_b] = _i
+    _BASE_CODES[ord(chr(_b).lower())] = _i
+
+_MIX1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = np.uint64(0x94d049bb133111eb)
+_HASH_SEED = np.uint64(0x9e3779b97f4a7c15)
+_LOW32 = np.uint64(0xffffffff)
+# Value of the bins of a sketch with no valid k-mers
+EMPTY = np.iinfo(np.uint32).max
+
+
+def error_bound(tol):
+    """
+    Maximum relative error of the approximate cluster count at identity
+    threshold `tol`, or None if there is no bound at this threshold.
+    """
+    # Round so thresholds from np.arange(...)/100 compare equal to the keys
+    tol = round(float(tol), 6)
+    return next((v for k, v in sorted(ERROR_BOUNDS.items(), reverse=True) if tol >= k), None)
+
+
+def _mix64(x):
+    """
+    splitmix64 finalizer, a cheap and well distributed 64 bit hash. numpy
+    uint64 arithmetic wraps on overflow, which is what we want here.
+    """
+    x = x ^ (x >> np.uint64(30))
+    x = x * _MIX1
+    x = x ^ (x >> np.uint64(27))
+    x = x * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+def _batch_kmers(seqs, k=8):
+    """
+    Get the k-mers of a batch of gapless sequences as 2-bit packed uint64
+    integers, and the index of the sequence each one came from. K-mers
+    containing ambiguous bases are skipped.
+    """
+    # Sequences are joined by a separator that is not a base, so k-mers
+    # spanning two sequences are dropped along with the ambiguous ones.
+    codes = _BASE_CODES[np.frombuffer("\0".join(seqs).encode(), dtype=np.uint8)]
+    nkmers = len(codes) - k + 1
+    if nkmers <= 0:
+        return np.array([], dtype=np.uint64), np.array([], dtype=np.intp)
+    bad = np.concatenate([[0], np.cumsum(codes == 255)])
+    valid = (bad[k:] - bad[:-k]) == 0
+    vals = np.zeros(nkmers, dtype=np.uint64)
+    codes = (codes & 3).astype(np.uint64)
+    for j in range(k):
+        vals = (vals << np.uint64(2)) | codes[j:j+nkmers]
+    rows = np.repeat(np.arange(len(seqs)), [len(x) + 1 for x in seqs])[:nkmers]
+    return vals[valid], rows[valid]
+
+
+def kmers(seq, k=8):
+    """
+    Get the set of k-mers in a sequence as 2-bit packed uint64 integers.
+    Gaps are removed and k-mers containing ambiguous bases are skipped.
+    """
+    return np.unique(_batch_kmers([seq.replace("-", "")], k=k)[0])
+
+
+def sketches(seqs, k=8, sketch_size=256):
+    """
+    One permutation MinHash sketches of a batch of gapless sequences.
+
+    Each k-mer is hashed once, the top bits of the hash pick one of
+    `sketch_size` bins and the sketch keeps the minimum of the low 32 bits in
+    each bin. Empty bins borrow the value of the next non-empty bin (wrapping
+    around), rehashed with the distance borrowed from, so the probability two
+    sketches match in a bin is still their k-mer Jaccard similarity.
+
+    Returns a uint32 array of shape (len(seqs), sketch_size). Rows for
+    sequences with no valid k-mers are all EMPTY.
+    """
+    nbits = int(sketch_size).bit_length() - 1
+    if sketch_size < 2 or 2**nbits != sketch_size:
+        raise ValueError("sketch_size must be a power of 2.")
+
+    kms, rows = _batch_kmers(seqs, k=k)
+    hashes = _mix64(kms ^ _HASH_SEED)
+    bins = rows*sketch_size + (hashes >> np.uint64(64 - nbits)).astype(np.intp)
+    sk = np.full(len(seqs)*sketch_size, EMPTY, dtype=np.uint32)
+    np.minimum.at(sk, bins, (hashes & _LOW32).astype(np.uint32))
+    filled = np.zeros(len(sk), dtype=bool)
+    filled[bins] = True
+    sk = sk.reshape(len(seqs), sketch_size)
+    filled = filled.reshape(sk.shape)
+
+    # Densify: for each bin find the next filled bin to the right (wrapping),
+    # by a reversed running minimum over the row laid out twice.
+    hasany = filled.any(axis=1)
+    empty = ~filled & hasany[:, None]
+    if empty.any():
+        pos = np.arange(2*sketch_size)
+        nxt = np.where(np.tile(filled, 2), pos, 2*sketch_size)
+        nxt = np.minimum.accumulate(nxt[:, ::-1], axis=1)[:, ::-1][:, :sketch_size]
+        r, c = np.nonzero(empty)
+        dist = (nxt[r, c] - c).astype(np.uint64)
+        borrowed = sk[r, nxt[r, c] % sketch_size].astype(np.uint64)
+        sk[r, c] = (_mix64(borrowed | (dist << np.uint64(32))) & _LOW32).astype(np.uint32)
+    return sk
+
+
+def minhash(seq, k=8, sketch_size=256):
+    """
+    MinHash sketch of the k-mers in `seq`, see `sketches`.
+    Returns a uint32 array of length `sketch_size`.
+    """
+    return sketches([seq.replace("-", "")], k=k, sketch_size=sketch_size)[0]
+
+
+def jaccard_thresholds(tols, k=8, background=0):
+    """
+    Convert identity thresholds to k-mer Jaccard similarity thresholds.
+
+    A fraction tol**k of k-mers is expected to be unaffected by the differences
+    between two sequences with identity `tol`, and a fraction `background` of
+    the remaining k-mers is shared by chance.
+    """
+    shared = np.asarray(tols, dtype=float)**k
+    shared = shared + (1 - shared)*background
+    return shared/(2 - shared)
+
+
+def background_sharing(seqs, k=8):
+    """
+    Probability that a k-mer is present in an unrelated sequence by chance,
+    given the base composition and mean length of `seqs`.
+    """
+    codes = _BASE_CODES[np.frombuffer("".join(seqs).encode(), dtype=np.uint8)]
+    codes = codes[codes != 255]
+    if not len(codes):
+        return 0
+    freqs = np.bincount(codes, minlength=4)/len(codes)
+    # Probability two random k-mers are identical
+    pmatch = np.sum(freqs**2)**k
+    mean_len = len(codes)/len(seqs)
+    return 1 - np.exp(-mean_len*pmatch)
+
+
+def read_sequences(path, fastq=False):
+    """
+    Iterate over the sequences in a fasta or fastq file without reading the
+    whole file into memory. Fasta sequences may span multiple lines.
+    """
+    with open(path) as infile:
+        if fastq:
+            for i, line in enumerate(infile):
+                if i % 4 == 1:
+                    yield line.strip()
+            return
+        seq = None
+        for line in infile:
+            if line.startswith(">"):
+                if seq is not None:
+                    yield "".join(seq)
+                seq = []
+            elif seq is not None:
+                seq.append(line.strip())
+        if seq is not None:
+            yield "".join(seq)
+
+
+def _band_keys(sk, band_rows):
+    """
+    Hash each band of `band_rows` consecutive sketch values (and the band
+    number) to one uint64 key. Returns an array of shape (len(sk), nbands).
+    """
+    nbands = sk.shape[1]//band_rows
+    vals = sk[:, :nbands*band_rows].reshape(len(sk), nbands, band_rows).astype(np.uint64)
+    keys = np.broadcast_to(_mix64(np.arange(nbands, dtype=np.uint64) + _HASH_SEED),
+                            (len(sk), nbands))
+    for j in range(band_rows):
+        keys = _mix64(keys ^ vals[:, :, j])
+    return keys
+
+
+class _SeedIndex(object):
+    """
+    Sketches of all sequences that are a seed at one or more thresholds, and
+    a mask of which thresholds each one is a seed at.
+
+    Each threshold is searched with the LSH index with the most rows per band
+    (the most selective) that still reaches LSH_RECALL at its Jaccard
+    threshold, or by comparing to all of its seeds if none does. An index
+    holds the sorted band keys of the seeds of its thresholds and the seed
+    each key belongs to.
+    """
+    def __init__(self, jaccard, sketch_size, band_rows=(4, 2)):
+        self.sketch_size = sketch_size
+        self.sketches = np.empty((1024, sketch_size), dtype=np.uint32)
+        self.is_seed = np.zeros((1024, len(jaccard)), dtype=bool)
+        self.n = 0
+        # Rows per band used to search each threshold, 0 for no index
+        self.method = np.zeros(len(jaccard), dtype=int)
+        for rows in sorted(band_rows):
+            nbands = sketch_size//rows
+            recall = 1 - (1 - jaccard**rows)**nbands
+            self.method[recall >= LSH_RECALL] = rows
+        self.index = {rows:(np.array([], dtype=np.uint64), np.array([], dtype=np.intp))
+                        for rows in set(self.method[self.method > 0])}
+
+    def add(self, sk, is_seed):
+        while self.n + len(sk) > len(self.sketches):
+            self.sketches = np.concatenate([self.sketches, np.empty_like(self.sketches)])
+            self.is_seed = np.concatenate([self.is_seed, np.zeros_like(self.is_seed)])
+        ids = np.arange(self.n, self.n + len(sk))
+        self.sketches[ids] = sk
+        self.is_seed[ids] = is_seed
+        self.n += len(sk)
+
+        for rows, (index_keys, index_ids) in self.index.items():
+            # Only index the seeds of the thresholds this index searches
+            mask = is_seed[:, self.method == rows].any(axis=1)
+            if not mask.any():
+                continue
+            keys = _band_keys(sk[mask], rows)
+            kids = np.repeat(ids[mask], keys.shape[1])
+            order = np.argsort(keys.ravel())
+            keys = keys.ravel()[order]
+            pos = np.searchsorted(index_keys, keys)
+            self.index[rows] = (np.insert(index_keys, pos, keys),
+                                np.insert(index_ids, pos, kids[order]))
+
+    def candidates(self, sk, rows):
+        """
+        Pairs of (query row, seed id) that share at least one band in the
+        index with `rows` rows per band.
+        """
+        index_keys, index_ids = self.index[rows]
+        keys = _band_keys(sk, rows)
+        lo = np.searchsorted(index_keys, keys.ravel(), side="left")
+        hi = np.searchsorted(index_keys, keys.ravel(), side="right")
+        counts = hi - lo
+        if not counts.sum():
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+        queries = np.repeat(np.arange(len(sk)), keys.shape[1])
+        queries = np.repeat(queries, counts)
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        seeds = index_ids[starts + np.arange(len(starts))]
+        pairs = np.unique(queries*self.n + seeds)
+        return pairs//self.n, pairs % self.n
+
+    def hits(self, sk, need, chunk=1 << 24):
+        """
+        Which thresholds each sketch in `sk` hits an existing seed at. `chunk`
+        caps the size of the temporary comparison arrays (in sketch values).
+        """
+        hit = np.zeros((len(sk), len(need)), dtype=bool)
+        if not self.n:
+            return hit
+
+        for rows in self.index:
+            cols = self.method == rows
+            queries, seeds = self.candidates(sk, rows)
+            step = max(1, chunk//self.sketch_size)
+            for i in range(0, len(queries), step):
+                q, s = queries[i:i+step], seeds[i:i+step]
+                matches = np.count_nonzero(sk[q] == self.sketches[s], axis=1)
+                ok = (matches[:, None] >= need[cols]) & self.is_seed[s][:, cols]
+                sub = hit[:, cols]
+                np.logical_or.at(sub, q, ok)
+                hit[:, cols] = sub
+
+        cols = self.method == 0
+        seeds = np.flatnonzero(self.is_seed[:self.n, cols].any(axis=1))
+        if len(seeds):
+            pool = self.sketches[seeds]
+            is_seed = self.is_seed[seeds][:, cols]
+            step = max(1, chunk//(len(seeds)*self.sketch_size))
+            for i in range(0, len(sk), step):
+                matches = np.count_nonzero(sk[i:i+step, None, :] == pool[None, :, :], axis=2)
+                hit[i:i+step, cols] = ((matches[:, :, None] >= need[cols])\
+                                            & is_seed[None, :, :]).any(axis=1)
+        return hit
+
+
+def cluster_counts(seqs,
+                    tols,
+                    k=8,
+                    sketch_size=256,
+                    band_rows=(4, 2),
+                    batch_size=4096,
+                    verbose=False):
+    """
+    Estimate the number of greedy clusters at each identity threshold.
+
+    seqs (iterable) - Sequences, in the order they would be clustered. Can be
+                      a generator (e.g. read_sequences), it is consumed in
+                      batches of `batch_size`.
+    tols (array-like) - Identity thresholds as fractions (e.g. 0.97)
+    band_rows (tuple) - Sketch values per band of each LSH index
+    batch_size (int) - Number of sequences to sketch and compare at once
+
+    Returns an array of cluster counts, one per threshold. Thresholds >= 1 are
+    counted exactly as the number of unique sequences. The chance k-mer
+    sharing is estimated from the first batch.
+    """
+    tols = np.asarray(tols, dtype=float)
+    counts = np.zeros(len(tols), dtype=int)
+    exact = tols >= 1
+    approx = ~exact
+
+    seqs = iter(seqs)
+    nseqs = 0
+    # Hashes of the unique sequences of each batch, for the exact count
+    hashes = []
+    need = index = None
+    nclusts = np.zeros(approx.sum(), dtype=int)
+    while True:
+        batch = list(itertools.islice(seqs, batch_size))
+        if not batch:
+            break
+        nseqs += len(batch)
+        # Duplicates always join the cluster of their first copy (their
+        # sketches are identical), so only unique sequences are sketched.
+        batch = list(dict.fromkeys(x.replace("-", "").upper() for x in batch))
+        hashes.append(np.fromiter(map(hash, batch), dtype=np.int64, count=len(batch)))
+        if not approx.any():
+            continue
+
+        if need is None:
+            jacc = jaccard_thresholds(tols[approx], k=k,
+                                        background=background_sharing(batch, k=k))
+            need = jacc*sketch_size
+            index = _SeedIndex(jacc, sketch_size, band_rows=band_rows)
+
+        sk = sketches(batch, k=k, sketch_size=sketch_size)
+        # Sequences with no valid k-mers never match anything
+        nokmers = (sk == EMPTY).all(axis=1)
+        nclusts += nokmers.sum()
+        sk = sk[~nokmers]
+
+        hit = index.hits(sk, need)
+        # Queries that are a new seed at some threshold given the seeds of
+        # previous batches, clustered in order against the seeds of this batch
+        misses = np.flatnonzero(~hit.all(axis=1))
+        new_sk = np.empty((len(misses), sketch_size), dtype=np.uint32)
+        new_seed = np.zeros((len(misses), len(need)), dtype=bool)
+        nnew = 0
+        for i in misses:
+            h = hit[i]
+            if nnew:
+                matches = np.count_nonzero(new_sk[:nnew] == sk[i], axis=1)
+                h = h | ((matches[:, None] >= need) & new_seed[:nnew]).any(axis=0)
+            if h.all():
+                continue
+            new_sk[nnew] = sk[i]
+            new_seed[nnew] = ~h
+            nnew += 1
+            nclusts += ~h
+        if nnew:
+            index.add(new_sk[:nnew], new_seed[:nnew])
+        if verbose: print(f"  Sketched {nseqs} sequences, {index.n} seeds")
+
+    counts[exact] = len(np.unique(np.concatenate(hashes))) if hashes else 0
+    counts[approx] = nclusts
+    return counts
@@ -0,0 +1,72 @@
+"""
+Import-time benchmark for the BCI package.
+
+Runs `import BCI` in fresh interpreters and reports the median wall-clock
+import time. Exits non-zero if the median exceeds the startup budget or if
+any of the heavy dependencies are loaded at import time.
+
+Usage:
+    python benchmarks/import_time.py [-n 10] [--budget 300]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Startup budget for `import BCI`, in milliseconds. numpy is the only heavy
+# dependency that is allowed to load at import time.
+BUDGET_MS = 300
+
+# These should only ever be imported on first use
+HEAVY_MODULES = ["matplotlib", "pandas", "scipy", "joblib"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import BCI
+elapsed = (time.perf_counter() - t0) * 1000
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"ms": elapsed, "heavy": heavy}}))
+"""
+
+
+def time_import(nruns=10):
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    probe = _PROBE.format(heavy=HEAVY_MODULES)
+    times = []
+    heavy = set()
+    for _ in range(nruns):
+        out = subprocess.check_output([sys.executable, "-c", probe], cwd=repo)
+        res = json.loads(out)
+        times.append(res["ms"])
+        heavy.update(res["heavy"])
+    return times, sorted(heavy)
+
+
+def main():
+    psr = argparse.ArgumentParser(description="Benchmark `import BCI` time.")
+    psr.add_argument("-n", "--nruns", type=int, default=10,
+                     help="Number of fresh interpreters to time.")
+    psr.add_argument("--budget", type=float, default=BUDGET_MS,
+                     help="Startup budget in ms for the median import time.")
+    args = psr.parse_args()
+
+    times, heavy = time_import(args.nruns)
+    median = statistics.median(times)
+    print(f"  import BCI: median {median:.1f} ms, min {min(times):.1f} ms,"
+          f" max {max(times):.1f} ms over {len(times)} runs (budget {args.budget:.0f} ms)")
+
+    ok = True
+    if heavy:
+        print(f"  Heavy modules loaded at import time: {', '.join(heavy)}")
+        ok = False
+    if median > args.budget:
+        print(f"  Median import time exceeds the startup budget.")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
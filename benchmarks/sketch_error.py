@@ -0,0 +1,144 @@
+"""
+Accuracy benchmark for the approximate (MinHash sketch) BCI mode.
+
+Clusters the same fasta file with a reference method and approximately, and
+reports the relative error of the approximate cluster counts at each identity
+threshold. Exits non-zero if any error exceeds the bounds in BCI.sketch.ERROR_BOUNDS.
+Thresholds without a bound are reported but not checked.
+
+The reference counts come from exact mode (vsearch, the default, needs vsearch
+and muscle) or, with `--reference aligned` for input that is already aligned,
+from an alignment proxy: greedy clustering on the given alignment with
+vsearch's default identity definition, but no pairwise alignment. The proxy is
+not exact mode. `--write` saves the reference counts in the format used by
+tests/test_sketch.py.
+
+Usage:
+    python benchmarks/sketch_error.py [-i Sequences.fasta] [--reference vsearch|aligned]
+                                      [--write tests/data/canary_beetles_vsearch_counts.tsv]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import numpy as np
+import BCI
+from BCI import sketch
+
+DEFAULT_INPUT = os.path.join(REPO, "empirical-examples",
+                             "Salces-Castellano-2021-CanaryBeetles", "Sequences.fasta")
+# Lowest threshold used by Project
+DEFAULT_MIN_THRESHOLD = 70
+
+
+def vsearch_counts(data, tols, project_dir):
+    """
+    Exact cluster counts at each threshold, in the order of `tols`.
+    """
+    bci = BCI.BCI(data, project_dir=project_dir)
+    bci._min_clust_threshold = int(round(min(tols)*100)) - 1
+    bci.run()
+    counts = np.array([int(len(open(x).readlines())/2) for x in bci.seed_files])
+    bci.clean()
+    return counts
+
+
+def aligned_counts(data, tols):
+    """
+    Alignment proxy for exact mode: greedy clustering (in input order, like
+    -usersort) of aligned sequences.
+    Identity is the number of matching columns over the number of columns
+    that aren't gaps in both sequences, ignoring terminal gaps, which is
+    vsearch's default definition (-iddef 2) computed on the given alignment
+    rather than on a pairwise alignment.
+    """
+    # Unique sequences in order of first occurrence
+    uniq = {}
+    for seq in sketch.read_sequences(data):
+        uniq.setdefault(seq.replace("-", "").upper(), seq.upper())
+    seqs = list(uniq.values())
+    length = max(len(x) for x in seqs)
+    arr = np.full((len(seqs), length), ord("-"), dtype=np.uint8)
+    for i, seq in enumerate(seqs):
+        arr[i, :len(seq)] = np.frombuffer(seq.encode(), dtype=np.uint8)
+    gap = arr == ord("-")
+    start = np.argmax(~gap, axis=1)
+    end = length - np.argmax(~gap[:, ::-1], axis=1)
+    cols = np.arange(length)
+
+    counts = []
+    for tol in tols:
+        if tol >= 1:
+            counts.append(len(seqs))
+            continue
+        seeds = [0]
+        for i in range(1, len(seqs)):
+            s = np.array(seeds)
+            inside = (cols >= np.maximum(start[s], start[i])[:, None])\
+                        & (cols < np.minimum(end[s], end[i])[:, None])
+            matches = ((arr[s] == arr[i]) & ~gap[s] & ~gap[i] & inside).sum(axis=1)
+            columns = (inside & ~(gap[s] & gap[i])).sum(axis=1)
+            if not (matches >= tol*np.maximum(columns, 1)).any():
+                seeds.append(i)
+        counts.append(len(seeds))
+    return np.array(counts)
+
+
+def main():
+    psr = argparse.ArgumentParser(description="Compare approximate BCIs to exact mode or a proxy.")
+    psr.add_argument("-i", "--input", default=DEFAULT_INPUT,
+                     help="Fasta file to benchmark on.")
+    psr.add_argument("-m", "--min-threshold", type=int, default=DEFAULT_MIN_THRESHOLD,
+                     help="Lowest identity threshold (percent, exclusive).")
+    psr.add_argument("--reference", choices=["vsearch", "aligned"], default="vsearch",
+                     help="How to get the reference counts, exact mode or the alignment proxy.")
+    psr.add_argument("--write", default=None,
+                     help="Save the reference counts to this file.")
+    args = psr.parse_args()
+
+    if args.reference == "vsearch":
+        for prog in ["vsearch", "muscle"]:
+            if not shutil.which(prog):
+                sys.exit(f"  {prog} is not installed, it's needed for the exact run.")
+
+    tols = np.arange(100, args.min_threshold, -1)/100
+    start = time.perf_counter()
+    if args.reference == "vsearch":
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ref = vsearch_counts(args.input, tols, tmpdir)
+    else:
+        ref = aligned_counts(args.input, tols)
+    t_ref = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx = sketch.cluster_counts(sketch.read_sequences(args.input), tols)
+    t_approx = time.perf_counter() - start
+
+    if args.write:
+        source = "exact mode (vsearch)" if args.reference == "vsearch"\
+                    else "alignment proxy (greedy clustering on the alignment, not vsearch)"
+        header = f"Reference cluster counts for {os.path.basename(args.input)} from {source}\ntol\tcount"
+        np.savetxt(args.write, np.column_stack([tols, ref]), fmt=["%.2f", "%d"],
+                    delimiter="\t", header=header)
+
+    relerr = (approx - ref)/np.maximum(ref, 1)
+    print(f"  reference ({args.reference}) {t_ref:.1f} s, approximate {t_approx:.1f} s")
+    print(f"  tol\t{args.reference}\tapprox\trel_err\tbound")
+    ok = True
+    for tol, e, a, err in zip(tols, ref, approx, relerr):
+        bound = sketch.error_bound(tol)
+        flag = "" if bound is None or abs(err) <= bound else "  <- exceeds bound"
+        ok = ok and not flag
+        bound = "-" if bound is None else f"{bound:.2f}"
+        print(f"  {tol:.2f}\t{e}\t{a}\t{err:+.3f}\t{bound}{flag}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from BCI import BCI
+
+
+def _write_fasta(path, records):
+    with open(path, 'w') as outfile:
+        for name, seq in records:
+            outfile.write(f">{name}\n{seq}\n")
+
+
+def test_simulated_dereplication_keeps_species(tmp_path):
+    # The same haplotype occurs in two species
+    data = tmp_path / "sim.fasta"
+    _write_fasta(data, [("r0_0", "AAAA"), ("r0_1", "AAAA"), ("r0_2", "AAAT"),
+                        ("r1_0", "AAAA"), ("r1_1", "AAAA")])
+    bci = BCI(str(data), project_dir=str(tmp_path))
+
+    _, abundances = bci._dereplicate_data(simulated=True)
+    assert abundances == {"r0_0":2, "r0_2":1, "r1_0":2}
+
+    _, abundances = bci._dereplicate_data()
+    assert abundances == {"r0_0":4, "r0_2":1}
+
+
+def test_weighted_pi_matches_duplicates(tmp_path):
+    data = tmp_path / "sample.fasta"
+    _write_fasta(data, [("z1", "AAAAAAAAAA")])
+    bci = BCI(str(data), project_dir=str(tmp_path))
+
+    uniq = ["AAAAAAAAAA", "AAAAAAAAAT", "AAAAACAAAT"]
+    counts = [3, 2, 1]
+    expanded = [x for x, n in zip(uniq, counts) for _ in range(n)]
+    weighted = bci._nucleotide_diversity(pd.Series(uniq), counts=counts)
+    assert weighted > 0
+    assert weighted == pytest.approx(bci._nucleotide_diversity(pd.Series(expanded)))
+
+
+def test_align_otus_carries_counts(tmp_path):
+    data = tmp_path / "sample.fasta"
+    _write_fasta(data, [("z1", "AAAA"), ("z2", "AAAT"), ("z3", "AAAA"), ("z4", "CCCC")])
+    bci = BCI(str(data), project_dir=str(tmp_path), dereplicate=True)
+    bci.cores = 1
+    bci._clust_data, bci._abundances = bci._dereplicate_data()
+    # vsearch userfields query+target+id+gaps+qstrand+qcov
+    (tmp_path / ".tmpdir-sample" / "sample-0.97.utmp").write_text("z2\tz1\t75.0\t0\t+\t100.0\n")
+
+    # Whether or not muscle is installed the OTU fastas and counts are written
+    _, abundances = bci._align_OTUs()
+    assert abundances == {"z1_0":1, "z1_1":2}
+    otu = (tmp_path / ".tmpdir-sample" / "OTU-0.97_fastas" / "z1.fasta").read_text()
+    assert otu == ">z1_0\nAAAT\n>z1_1\nAAAA\n"
+
+
+def test_dereplicate_ignored_for_fastq(tmp_path, capsys):
+    data = tmp_path / "sample.fastq"
+    data.write_text("@z1\nAAAA\n+\nIIII\n")
+    BCI(str(data), project_dir=str(tmp_path), dereplicate=True)
+    assert "dereplicate is only supported for fasta input" in capsys.readouterr().out
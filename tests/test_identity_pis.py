@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from BCI import BCI
+
+# z1 is the seed of z2 (1 difference) and z3 (2 other differences), z4 is a
+# singleton. The differences aren't shared, so the identity based pi is exact.
+SEQS = {"z1":"AAAAAAAAAA",
+        "z2":"TAAAAAAAAA",
+        "z3":"AAAAAAAAGG",
+        "z4":"CCCCCCCCCC"}
+# vsearch userfields query+target+id+gaps+qstrand+qcov
+UTMP = "z2\tz1\t90.0\t0\t+\t100.0\nz3\tz1\t80.0\t0\t+\t100.0\n"
+
+
+def _bci(tmp_path, abundances=None):
+    data = tmp_path / "sample.fasta"
+    data.write_text("".join(f">{k}\n{v}\n" for k, v in SEQS.items()))
+    bci = BCI(str(data), project_dir=str(tmp_path))
+    (tmp_path / ".tmpdir-sample" / "sample-0.97.utmp").write_text(UTMP)
+    bci._abundances = abundances
+    return bci
+
+
+def _expanded_pi(bci, abundances):
+    seqs = [SEQS[x] for x in ["z1", "z2", "z3"] for _ in range(abundances.get(x, 1))]
+    return bci._nucleotide_diversity(pd.Series(seqs))
+
+
+def test_identity_pis(tmp_path):
+    bci = _bci(tmp_path)
+    pis = bci._identity_pis()
+
+    assert pis["z1"] == pytest.approx(0.2)
+    assert pis["z1"] == pytest.approx(_expanded_pi(bci, {}))
+    assert bci._otu_sizes == {"z1":3, "z4":1}
+
+
+def test_identity_pis_weighted(tmp_path):
+    abundances = {"z1":2, "z2":1, "z3":3, "z4":1}
+    bci = _bci(tmp_path, abundances=abundances)
+    pis = bci._identity_pis()
+
+    assert pis["z1"] == pytest.approx(2.3/15)
+    assert pis["z1"] == pytest.approx(_expanded_pi(bci, abundances))
+
+
+def test_identity_pis_singleton(tmp_path):
+    bci = _bci(tmp_path, abundances={"z1":1, "z2":1, "z3":1, "z4":5})
+    pis = bci._identity_pis()
+
+    # Copies of a singleton are identical
+    assert pis["z4"] == 0
+
+
+def test_validate_pis_flags(tmp_path, capsys):
+    bci = _bci(tmp_path)
+    bci.pis = {"z1":0.2, "z5":0.1, "z6":0.1}
+    bci._validate_pis({"z1":0.21, "z5":0.2, "z6":0})
+
+    assert bci.pi_validation["flagged"].tolist() == [False, True, True]
+    assert "for 2 of 3 validated OTUs" in capsys.readouterr().out
+
+
+def test_validate_pis_missing(tmp_path, capsys):
+    bci = _bci(tmp_path)
+    bci.pis = {"z1":0.2, "z5":0.1}
+    # No alignments, e.g. muscle failed
+    bci._validate_pis({}, otus=["z1", "z5"])
+
+    assert len(bci.pi_validation) == 0
+    assert "no alignment based pi for 2 of 2 OTUs" in capsys.readouterr().out
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from BCI import BCI, pipeline, simulation_features
+
+SEQS = ["ACGTACGTTGCAACGTAGCTAGCTAGGATCCATGCA",
+        "ACGTACGTTGCAACGTAGCTAGCTAGGATCCATGCT",
+        "TTGCAACGTACGTAGCTAGCATGCAACGTGGATCCA"]
+# Stand-ins for the pis, which need vsearch and muscle
+SIM_PIS = {"r0":0.01, "r1":0.02, "r2":0}
+HILL_NUMBERS = [3, 2.5, 2, 1.5]
+_run = BCI.run
+
+
+def _simulations(tmp_path, monkeypatch, fail=(), calls=None):
+    simdir = tmp_path / "sims"
+    simdir.mkdir(exist_ok=True)
+    for sim in ["sim0", "sim1", "sim2"]:
+        (simdir / f"{sim}.fasta").write_text("".join(f">r{i}_0\n{x}\n" for i, x in enumerate(SEQS)))
+
+    # vsearch isn't needed to test the batch handling, cluster approximately
+    # and fail the simulations in `fail`
+    def run(self, simulated=False, approximate=None, verbose=False):
+        if calls is not None:
+            calls.append(self.samp)
+        if self.samp in fail:
+            raise ValueError(f"{self.samp} is broken")
+        _run(self, simulated=simulated, approximate=True, verbose=verbose)
+        self.sim_pis = SIM_PIS
+        self.hill_numbers = HILL_NUMBERS
+    monkeypatch.setattr(BCI, "run", run)
+    return str(simdir)
+
+
+def test_failed_simulations_dont_stop_the_batch(tmp_path, monkeypatch):
+    outdir = str(tmp_path / "out")
+    simdir = _simulations(tmp_path, monkeypatch, fail={"sim1"})
+    feats = simulation_features(simdir, outdir, n_jobs=1)
+
+    assert sorted(feats.index) == ["sim0", "sim2"]
+    with open(os.path.join(outdir, "sim1" + pipeline.ERROR_SUFFIX)) as infile:
+        assert "sim1 is broken" in infile.read()
+
+    # Failed simulations are skipped on re-runs unless retried
+    simdir = _simulations(tmp_path, monkeypatch, fail=set())
+    feats = simulation_features(simdir, outdir, n_jobs=1)
+    assert sorted(feats.index) == ["sim0", "sim2"]
+
+    feats = simulation_features(simdir, outdir, n_jobs=1, retry_failed=True)
+    assert sorted(feats.index) == ["sim0", "sim1", "sim2"]
+    assert not os.path.exists(os.path.join(outdir, "sim1" + pipeline.ERROR_SUFFIX))
+
+
+def test_feature_row(tmp_path, monkeypatch):
+    simdir = _simulations(tmp_path, monkeypatch)
+    params = pd.DataFrame({"theta":[0.1, 0.2, 0.3], "ntaxa":[5, 10, 15]},
+                            index=["sim0", "sim1", "sim2"])
+    feats = simulation_features(simdir, str(tmp_path / "out"), params=params, n_jobs=1)
+
+    bci = BCI(os.path.join(simdir, "sim0.fasta"), project_dir=str(tmp_path))
+    bci._min_clust_threshold = 70
+    _run(bci, approximate=True)
+    bci_cols = [f"bci_{x:.2f}" for x in np.arange(100, 70, -1)/100]
+    assert [x for x in feats.columns if x.startswith("bci_")] == bci_cols
+    assert feats.loc["sim0", bci_cols].tolist() == list(bci.bci)
+
+    sim_hills = [bci._generalized_hill_number(list(SIM_PIS.values()), order=x) for x in range(4)]
+    assert feats.loc["sim0", [f"sim_pi_h{x}" for x in range(4)]].tolist() == pytest.approx(sim_hills)
+    assert feats.loc["sim0", [f"otu_pi_h{x}" for x in range(4)]].tolist() == HILL_NUMBERS
+
+    assert feats["theta"].tolist() == [0.1, 0.2, 0.3]
+    assert feats["ntaxa"].tolist() == [5, 10, 15]
+
+
+def test_params_cant_replace_features(tmp_path, monkeypatch):
+    simdir = _simulations(tmp_path, monkeypatch)
+    params = pd.DataFrame({"bci_1.00":[1, 2, 3]}, index=["sim0", "sim1", "sim2"])
+    with pytest.raises(ValueError, match="bci_1.00"):
+        simulation_features(simdir, str(tmp_path / "out"), params=params, n_jobs=1)
+
+
+def test_rerun_skips_done_simulations(tmp_path, monkeypatch):
+    outdir = str(tmp_path / "out")
+    calls = []
+    simdir = _simulations(tmp_path, monkeypatch, calls=calls)
+    first = simulation_features(simdir, outdir, n_jobs=1)
+    assert sorted(calls) == ["sim0", "sim1", "sim2"]
+
+    os.remove(os.path.join(outdir, "sim1" + pipeline.FEATURES_SUFFIX))
+    calls.clear()
+    feats = simulation_features(simdir, outdir, n_jobs=1)
+    assert calls == ["sim1"]
+    pd.testing.assert_frame_equal(feats, first)
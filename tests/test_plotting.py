@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import LineCollection
+
+from BCI import Project, plot_multi, plotting
+
+
+def _bcis(n, prefix="s"):
+    return [SimpleNamespace(samp=f"{prefix}{i}", bci=list(range(30 + i, 10 + i, -1))) for i in range(n)]
+
+
+def test_plot_multi_draws_one_collection():
+    fig, ax = plot_multi(_bcis(5), linewidth=1)
+    assert len(ax.collections) == 1 and not ax.lines
+    assert ax.collections[0].get_linewidths()[0] == 1
+    plt.close(fig)
+
+
+def test_plot_multi_line2d_kwargs():
+    # Markers can't go in a LineCollection, these fall back to one line per curve
+    fig, ax = plot_multi(_bcis(5), marker="o")
+    assert len(ax.lines) == 5 and ax.lines[0].get_marker() == "o"
+    plt.close(fig)
+
+    # Aliases don't clash with the default line width
+    fig, ax = plot_multi(_bcis(5), summary=True, lw=1)
+    assert ax.lines[0].get_linewidth() == 1
+    plt.close(fig)
+
+
+def test_plot_sites_labels_groups_by_site():
+    proj = Project.__new__(Project)
+    sites = _bcis(2*plotting.MAX_LEGEND_CURVES, prefix="site")
+    proj.site_bcis = {x.samp:x for x in sites}
+    names = list(proj.site_bcis)
+    half = len(names)//2
+
+    fig, ax = proj.plot_sites(cmaps={"Spectral":names[:half], "viridis":names[half:]})
+    labels = [x.get_text() for x in ax.get_legend().get_texts()]
+    assert labels == [f"site0, site1, site2 (+{half - 3} more)",
+                      f"site{half}, site{half + 1}, site{half + 2} (+{half - 3} more)"]
+    plt.close(fig)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from BCI import Project
+
+SEQS = {"zotu1":"ACGTACGTTGCAACGTAGCTAGCTAGGATCCATGCA",
+        "zotu2":"ACGTACGTTGCAACGTAGCTAGCTAGGATCCATGCT",
+        "zotu3":"TTGCAACGTACGTAGCTAGCATGCAACGTGGATCCA",
+        "zotu4":"TTGCAACGTACGTAGCTAGCATGCAACGTGGATCGA"}
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def _project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fasta = _write(tmp_path / "asvs.fasta", "".join(f">{k}\n{v}\n" for k, v in SEQS.items()))
+    asvs = _write(tmp_path / "asvs.tsv", "asv\ts1\ts2\nzotu1\t3\t0\nzotu2\t1\t2\nzotu3\t0\t5\n")
+    sitemap = _write(tmp_path / "sitemap.csv", "s1,site A\ns2,site A\n")
+    return Project(asvs, fasta, sitemap=sitemap)
+
+
+def test_update_site_with_space(tmp_path, monkeypatch):
+    proj = _project(tmp_path, monkeypatch)
+    proj.run(samples=False, approximate=True)
+    assert set(proj.site_fastas) == {"site A"}
+
+    asvs = _write(tmp_path / "new.tsv", "asv\ts3\nzotu3\t1\nzotu4\t2\n")
+    sitemap = _write(tmp_path / "new_sitemap.csv", "s3,site B\n")
+    samples, sites = proj.update(asv_table=asvs, sitemap=sitemap)
+
+    assert samples == ["s3"]
+    assert sites == ["site B"]
+    assert proj.site_fastas["site B"].endswith("site_B.fasta")
+    assert set(proj.site_bcis) == {"site A", "site B"}
+
+
+def test_update_keeps_integer_counts(tmp_path, monkeypatch):
+    proj = _project(tmp_path, monkeypatch)
+    asvs = _write(tmp_path / "new.tsv", "asv\ts3\nzotu3\t1\nzotu4\t2\n")
+    proj.update(asv_table=asvs, run=False)
+
+    assert list(proj.asv_table.columns) == ["s1", "s2", "s3"]
+    assert all(np.issubdtype(x, np.integer) for x in proj.asv_table.dtypes)
+    assert proj.asv_table.loc["zotu4", "s1"] == 0
+
+
+def test_update_removes_emptied_site(tmp_path, monkeypatch):
+    proj = _project(tmp_path, monkeypatch)
+    proj.update(asv_table=_write(tmp_path / "new.tsv", "asv\ts3\nzotu4\t2\n"),
+                sitemap=_write(tmp_path / "new_sitemap.csv", "s3,site B\n"), run=False)
+    proj.run(samples=False, approximate=True)
+    site_b = proj.site_fastas["site B"]
+
+    # Move the only sample of site B to site A
+    samples, sites = proj.update(sitemap=_write(tmp_path / "move.csv", "s3,site A\n"))
+
+    assert samples == []
+    assert sorted(sites) == ["site A", "site B"]
+    assert list(proj.samples_per_site) == ["site A"]
+    assert set(proj.site_fastas) == {"site A"}
+    assert set(proj.site_bcis) == {"site A"}
+    assert not (tmp_path / site_b).exists()
+
+
+def test_update_only_runs_selected_samples(tmp_path, monkeypatch):
+    proj = _project(tmp_path, monkeypatch)
+    proj.run(samples=["s1"], sites=False, approximate=True)
+
+    asvs = _write(tmp_path / "new.tsv", "asv\ts2\ts3\nzotu3\t1\t1\nzotu4\t2\t0\n")
+    samples, _ = proj.update(asv_table=asvs)
+
+    assert sorted(samples) == ["s2", "s3"]
+    assert set(proj.sample_bcis) == {"s1"}
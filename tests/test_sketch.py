@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from BCI import BCI, sketch
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, "empirical-examples",
+                    "Salces-Castellano-2021-CanaryBeetles", "Sequences.fasta")
+DATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# Reference cluster counts of DATA at thresholds 1.00 to 0.71, written by
+# benchmarks/sketch_error.py --write. The alignment proxy (greedy clustering on
+# the alignment in DATA) is not exact mode. The vsearch counts are exact mode,
+# and are only checked once they have been generated with
+# `--reference vsearch --write`.
+ALIGNED_REFERENCE = os.path.join(DATADIR, "canary_beetles_aligned_counts.tsv")
+VSEARCH_REFERENCE = os.path.join(DATADIR, "canary_beetles_vsearch_counts.tsv")
+
+
+def _check_bounds(reference, batch_size):
+    tols, ref = np.loadtxt(reference, unpack=True)
+    approx = sketch.cluster_counts(sketch.read_sequences(DATA), tols, batch_size=batch_size)
+
+    for tol, r, a in zip(tols, ref, approx):
+        bound = sketch.error_bound(tol)
+        if bound is None:
+            continue
+        assert abs(a - r)/max(r, 1) <= bound, f"{tol:.2f}: reference {r:.0f}, approximate {a}"
+    return tols, ref, approx
+
+
+@pytest.mark.parametrize("batch_size", [4096, 500])
+def test_cluster_counts_within_error_bounds_of_alignment_proxy(batch_size):
+    tols, ref, approx = _check_bounds(ALIGNED_REFERENCE, batch_size)
+    # The proxy counts unique sequences at 1.00
+    nuniq = len({x.replace("-", "").upper() for x in sketch.read_sequences(DATA)})
+    assert approx[tols >= 1].tolist() == ref[tols >= 1].tolist() == [nuniq]
+
+
+@pytest.mark.skipif(not os.path.exists(VSEARCH_REFERENCE),
+                    reason="vsearch reference counts not generated yet")
+def test_cluster_counts_within_error_bounds_of_exact_mode():
+    _check_bounds(VSEARCH_REFERENCE, 4096)
+
+
+def test_error_bound_range():
+    assert sketch.error_bound(0.99) == 0.10
+    assert sketch.error_bound(85/100) == 0.15
+    assert sketch.error_bound(0.84) is None
+
+
+def test_approximate_run_warns_without_bound(tmp_path):
+    bci = BCI(DATA, project_dir=str(tmp_path), approximate=True)
+    with pytest.warns(UserWarning, match="no error bound at thresholds 0.84 to 0.81"):
+        bci.run()
+    assert len(bci.bci) == len(bci.tols)
+
+
+def test_approximate_project_warns_once(tmp_path, monkeypatch):
+    import warnings
+    from BCI import Project
+
+    monkeypatch.chdir(tmp_path)
+    seqs = list(sketch.read_sequences(DATA))[:60]
+    (tmp_path / "asvs.fasta").write_text("".join(f">zotu{i}\n{x}\n" for i, x in enumerate(seqs)))
+    rows = "".join(f"zotu{i}\t{i % 3}\t{(i + 1) % 2}\n" for i in range(len(seqs)))
+    (tmp_path / "asvs.tsv").write_text("asv\ts1\ts2\n" + rows)
+    (tmp_path / "sitemap.csv").write_text("s1,A\ns2,B\n")
+    proj = Project("asvs.tsv", "asvs.fasta", sitemap="sitemap.csv")
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("default")
+        proj.run(approximate=True)
+    assert len(proj.sample_bcis) == 2 and len(proj.site_bcis) == 2
+    assert len([x for x in caught if "no error bound" in str(x.message)]) == 1